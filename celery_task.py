@@ -1,15 +1,59 @@
 #!/usr/bin/env python3
 
 from celery import Celery
+from celery import states
+from celery.signals import before_task_publish
+from celery.signals import task_prerun, task_postrun
+from celery.signals import worker_init
+from celery.signals import worker_process_init, worker_process_shutdown
 from shared import CONFIG
 
 from tortoise import Tortoise
-from web.db_models import Account
-from shared import DB_URL
+from web.db_models import TaskHistory, TaskHistoryArchive
+from shared import db_url_with_pool
+from shared import WORKER_POOL_MINSIZE, WORKER_POOL_MAXSIZE
 
+from task_events import publish_task_event
+
+import metrics
+
+import asyncio
+import datetime
+import os
+import threading
 import time
 
 
+# Simulated I/O wait of the sample divide task, in seconds.
+DIVIDE_DELAY: float = CONFIG["celery"].get("divide_delay", 5.0)
+
+# Celery states in which a task may still change.
+PENDING_STATES: tuple[str, ...] = ("PENDING", "STARTED")
+
+# Final states in which the task body never committed its credits.
+REFUND_STATES: tuple[str, ...] = (states.FAILURE, states.REVOKED)
+
+# TaskHistory rows reconciled per bulk UPDATE.
+RECONCILE_BATCH_SIZE: int = 500
+
+# Workers write statuses and results straight into TaskHistory and the
+# result backend stores nothing, so its memory stays flat under load.
+RESULTS_IN_DATABASE: bool = CONFIG["celery"].get("results_in_database", False)
+
+# Seconds the result backend keeps what it does store.
+RESULT_EXPIRES: int = CONFIG["celery"].get("result_expires", 3600)
+
+HISTORY_CONFIG: dict = CONFIG.get("history", {})
+
+# Finished tasks move from TaskHistory to TaskHistoryArchive after this
+# many days, and leave the archive after RETENTION_DAYS (0 keeps them).
+ARCHIVE_AFTER_DAYS: float = HISTORY_CONFIG.get("archive_after_days", 30)
+RETENTION_DAYS: float = HISTORY_CONFIG.get("retention_days", 0)
+
+# Tasks moved or purged per transaction.
+ARCHIVE_BATCH_SIZE: int = HISTORY_CONFIG.get("archive_batch_size", 1000)
+
+
 # Initialize Tortoise ORM and Celery
 celery_app = Celery(
     __name__,
@@ -18,58 +62,392 @@ celery_app = Celery(
     broker_connection_retry_on_startup=True,
 )
 
+# Workers reserve few messages ahead, so the tasks they pick next follow
+# the priorities set at submission (see scheduling.py). Queues are the
+# ones named by the task routes in config.toml, created on first use.
+celery_app.conf.worker_prefetch_multiplier = CONFIG["celery"].get(
+    "prefetch_multiplier", 1
+)
+
+celery_app.conf.result_expires = RESULT_EXPIRES
+celery_app.conf.task_ignore_result = RESULTS_IN_DATABASE
+
+# Run with `celery -A celery_task beat` next to the workers.
+celery_app.conf.beat_schedule = {
+    "archive-task-history": {
+        "task": "celery_task.archive_task_history",
+        "schedule": HISTORY_CONFIG.get("archive_interval", 3600.0),
+    },
+}
+# Only needed when the results are read back from the result backend.
+if not RESULTS_IN_DATABASE:
+    celery_app.conf.beat_schedule["reconcile-task-history"] = {
+        "task": "celery_task.reconcile_task_history",
+        "schedule": CONFIG["celery"].get("reconcile_interval", 2.0),
+    }
+
+
+# Port on which each worker exports its metrics, if any. Prefork
+# children share them through PROMETHEUS_MULTIPROC_DIR.
+METRICS_PORT: int | None = CONFIG.get("metrics", {}).get("worker_port")
+
 
 # Initialize Tortoise ORM (No schema generation)
 async def init_db():
-    await Tortoise.init(
-        db_url=DB_URL,
-        modules={
-            "models": ["web.db_models"]
+    with metrics.WORKER_DB_INIT_SECONDS.time():
+        await Tortoise.init(
+            db_url=db_url_with_pool(WORKER_POOL_MINSIZE, WORKER_POOL_MAXSIZE),
+            modules={
+                "models": ["web.db_models"]
+            }
+        )
+    metrics.instrument_tortoise()
+
+
+############################
+#                          #
+#      --- WORKER ---      #
+#                          #
+############################
+class WorkerLoop:
+    """
+    Long-lived event loop running in a background thread of the worker.
+
+    Task threads hand their coroutines over with `run` and block until
+    they finish, so with the threads pool (`-P threads`) the I/O waits of
+    many tasks overlap on one loop and one connection pool. Prefork and
+    solo workers behave as before, one task at a time per process.
+    """
+
+    def __init__(self, on_start=None, on_stop=None):
+        # Coroutine functions run on the loop right after it starts and
+        # right before it stops.
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread if needed and return its loop."""
+        with self._lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="worker-loop",
+                    daemon=True
+                )
+                self._thread.start()
+                if self.on_start is not None:
+                    asyncio.run_coroutine_threadsafe(
+                        self.on_start(), loop
+                    ).result()
+                self.loop = loop
+            return self.loop
+
+    def run(self, coro):
+        """Run `coro` on the loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start()).result()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.loop is None:
+                return
+            loop, self.loop = self.loop, None
+            if self.on_stop is not None:
+                asyncio.run_coroutine_threadsafe(
+                    self.on_stop(), loop
+                ).result()
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+            self._thread = None
+            loop.close()
+
+
+# Event loop owning the worker process' connection pool.
+worker_loop = WorkerLoop(
+    on_start=init_db,
+    on_stop=Tortoise.close_connections
+)
+
+
+def run_on_worker_loop(coro):
+    """Run `coro` to completion on the worker's long-lived event loop."""
+    return worker_loop.run(coro)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run blocking or CPU-heavy `func` in a thread, off the worker loop.
+
+    The loop keeps serving the other tasks' I/O meanwhile. Pure Python
+    CPU work still holds the GIL: scale it with prefork processes.
+    """
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+# Prefork children connect at startup; other pools (solo, threads) and
+# ad-hoc callers connect lazily on their first task.
+@worker_process_init.connect
+def open_worker_db(**_):
+    worker_loop.start()
+
+
+@worker_process_shutdown.connect
+def close_worker_db(**_):
+    worker_loop.stop()
+    metrics.mark_process_dead(os.getpid())
+
+
+@worker_init.connect
+def serve_worker_metrics(**_):
+    if METRICS_PORT is not None:
+        metrics.serve_metrics(METRICS_PORT)
+
+
+# Publication time, to measure how long tasks wait in their queue.
+@before_task_publish.connect
+def stamp_sent_at(headers, **_):
+    headers["sent_at"] = time.time()
+
+
+# perf_counter() at which each running task of this process started.
+_task_started_at: dict[str, float] = {}
+
+
+def result_to_json(result):
+    """JSON-storable form of a task's return value or exception."""
+    if isinstance(result, BaseException):
+        return {
+            "exc_type": type(result).__name__,
+            "exc_message": str(result),
         }
-    )
+    return result
+
+
+async def record_task_state(task_id: str, state: str, result=None) -> None:
+    """Write a status transition into TaskHistory, settling if it failed."""
+    await TaskHistory.record_state(task_id, state, result_to_json(result))
+    if state in REFUND_STATES:
+        await TaskHistory.settle_credits(task_id, refund=True)
+
+
+# Push status transitions to the API processes' event hubs, and write
+# them to TaskHistory when results live in the database.
+# Tasks receive the owner's account id as the `account_id` keyword.
+@task_prerun.connect
+def publish_task_started(task_id, task, args, kwargs, **_):
+    _task_started_at[task_id] = time.perf_counter()
+    sent_at = getattr(task.request, "sent_at", None)
+    if sent_at is not None:
+        metrics.TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(
+            max(0.0, time.time() - sent_at)
+        )
+
+    if RESULTS_IN_DATABASE and "account_id" in kwargs:
+        try:
+            run_on_worker_loop(record_task_state(task_id, states.STARTED))
+        except Exception as e:
+            metrics.ERRORS.labels("record_task_state").inc()
+            print(f"Error recording start of task {task_id}: {e}")
+
+    try:
+        publish_task_event(task_id, kwargs.get("account_id"), "STARTED")
+    except Exception as e:
+        metrics.ERRORS.labels("publish_task_event").inc()
+        print(f"Error publishing start of task {task_id}: {e}")
+
+
+@task_postrun.connect
+def publish_task_finished(task_id, task, args, kwargs, retval, state, **_):
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        metrics.TASK_RUNTIME_SECONDS.labels(task.name, state).observe(
+            time.perf_counter() - started_at
+        )
+
+    if RESULTS_IN_DATABASE and "account_id" in kwargs:
+        try:
+            run_on_worker_loop(record_task_state(task_id, state, retval))
+        except Exception as e:
+            metrics.ERRORS.labels("record_task_state").inc()
+            print(f"Error recording end of task {task_id}: {e}")
+
+    try:
+        publish_task_event(task_id, kwargs.get("account_id"), state, retval)
+    except Exception as e:
+        metrics.ERRORS.labels("publish_task_event").inc()
+        print(f"Error publishing end of task {task_id}: {e}")
 
 
 # Define the Celery task properly handling async code
 @celery_app.task(bind=True)
-def divide(self, x, y, user_id):
-    import asyncio
+def divide(self, x, y, account_id):
+    # Celery's request context is per thread: read the task id here,
+    # the coroutine runs on the worker loop's thread.
+    task_id = self.request.id
     # Capture the result of the async function
-    result = asyncio.run(run_divide(self, x, y, user_id))
+    result = run_on_worker_loop(run_divide(task_id, x, y, account_id))
     return result  # Return result properly to Celery
 
 
-async def run_divide(self, x, y, user_id):
-    await init_db()
-
+async def run_divide(task_id, x, y, account_id):
     try:
-        # Execute the Node.js script
-        time.sleep(5)  # Simulate a long-running operation
+        # Simulate a long-running I/O-bound operation. Awaiting instead
+        # of sleeping lets the loop run other tasks meanwhile; wrap
+        # blocking calls in `run_blocking` for the same reason.
+        await asyncio.sleep(DIVIDE_DELAY)
         result: float = x / y
-    except Exception as e:
-        await Tortoise.close_connections()
-        return {
-            "status": "error",
-            "message": "An unexpected error occurred",
-            "error": str(e),
-        }
+    except Exception:
+        # Failed runs give the reserved credit back, and raise so the
+        # task ends in FAILURE: only SUCCESS results are memoized.
+        await TaskHistory.settle_credits(task_id, refund=True)
+        raise
 
     #
     #  --> Sucessful run (without any exceptions):
     #
-    # Fetch the user account and deduct credits asynchronously
-    try:
-        account = await Account.get(google_id=user_id)
-        if account.credits < 1:
-            return {"RESULT": "Not enough credits"}
-
-        # Deduct the credit
-        account.credits -= 1
-        await account.save()
-        print(f"Credit deducted. Remaining credits: {account.credits}")
-    except Exception as e:
-        await Tortoise.close_connections()
-        return {"RESULT": f"Database error: {str(e)}"}
-
-    await Tortoise.close_connections()
+    # The credit was reserved at submission, commit it. Should this
+    # fail, the task fails and the credit is refunded.
+    await TaskHistory.settle_credits(task_id, refund=False)
 
     return result
+
+
+################################
+#                              #
+#      --- RECONCILER ---      #
+#                              #
+################################
+def fetch_task_metas(task_ids: list[str]) -> dict[str, dict]:
+    """
+    Read the result backend metadata of many tasks in one round trip.
+
+    Tasks unknown to the backend (still queued) are left out.
+    """
+    backend = celery_app.backend
+    with metrics.RESULT_BACKEND_SECONDS.labels("mget").time():
+        values = backend.mget(
+            [backend.get_key_for_task(task_id) for task_id in task_ids]
+        )
+    return {
+        task_id: backend.decode(value)
+        for task_id, value in zip(task_ids, values)
+        if value is not None
+    }
+
+
+def task_done_lag(meta: dict, now: datetime.datetime) -> float | None:
+    """Seconds elapsed between a task finishing and `now`."""
+    date_done = meta.get("date_done")
+    if date_done is None:
+        return None
+    if isinstance(date_done, str):
+        date_done = datetime.datetime.fromisoformat(date_done)
+    if date_done.tzinfo is None:
+        date_done = date_done.replace(tzinfo=datetime.timezone.utc)
+    return (now - date_done).total_seconds()
+
+
+@celery_app.task(ignore_result=True)
+def reconcile_task_history():
+    """Copy Celery statuses and results of in-flight tasks into TaskHistory."""
+    return run_on_worker_loop(run_reconcile_task_history())
+
+
+async def run_reconcile_task_history(
+    batch_size: int = RECONCILE_BATCH_SIZE
+        ) -> dict:
+    reconciled = 0
+    lags: list[float] = []
+    last_pk = 0
+    while True:
+        batch = await TaskHistory.filter(
+            status__in=PENDING_STATES,
+            id__gt=last_pk
+        ).order_by("id").limit(batch_size)
+        if not batch:
+            break
+        last_pk = batch[-1].id
+
+        metas = await asyncio.to_thread(
+            fetch_task_metas,
+            [row.task_id for row in batch]
+        )
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        changed = []
+        for row in batch:
+            meta = metas.get(row.task_id)
+            if meta is None or meta["status"] == row.status:
+                continue
+
+            row.status = meta["status"]
+            if meta["status"] in states.READY_STATES:
+                row.result = meta["result"]
+                lag = task_done_lag(meta, now)
+                if lag is not None:
+                    lags.append(lag)
+                    metrics.RECONCILE_LAG_SECONDS.observe(lag)
+            row.updated_at = now
+            changed.append(row)
+
+        if changed:
+            # One UPDATE statement for the whole batch.
+            await TaskHistory.bulk_update(
+                changed,
+                fields=["status", "result", "updated_at"]
+            )
+            reconciled += len(changed)
+
+        # Tasks that died without settling give their credits back.
+        for row in changed:
+            if row.status in REFUND_STATES and row.reserved_credits:
+                await TaskHistory.settle_credits(row.task_id, refund=True)
+
+    stats = {
+        "reconciled": reconciled,
+        "max_lag_seconds": max(lags, default=0.0),
+        "mean_lag_seconds": sum(lags) / len(lags) if lags else 0.0,
+    }
+    if reconciled:
+        print(f"Reconciled task history: {stats}")
+    return stats
+
+
+##############################
+#                            #
+#      --- ARCHIVER ---      #
+#                            #
+##############################
+@celery_app.task(ignore_result=True)
+def archive_task_history():
+    """Move old finished tasks to the archive and purge expired ones."""
+    return run_on_worker_loop(run_archive_task_history())
+
+
+async def run_archive_task_history(
+    batch_size: int = ARCHIVE_BATCH_SIZE
+        ) -> dict:
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    archived = 0
+    archive_before = now - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+    while moved := await TaskHistoryArchive.archive_batch(
+        archive_before, batch_size
+    ):
+        archived += moved
+
+    purged = 0
+    if RETENTION_DAYS > 0:
+        purge_before = now - datetime.timedelta(days=RETENTION_DAYS)
+        while deleted := await TaskHistoryArchive.purge_batch(
+            purge_before, batch_size
+        ):
+            purged += deleted
+
+    stats = {"archived": archived, "purged": purged}
+    if archived or purged:
+        print(f"Archived task history: {stats}")
+    return stats
@@ -3,40 +3,58 @@
 # to calculate expiration of the JWT
 import datetime
 
+import asyncio
+import functools
+import email.utils
+import base64
+import hashlib
+import math
 import secrets
+import time
+import uuid
 
-from fastapi import FastAPI, Depends, HTTPException, Security, Request
+from typing import Any
+
+from fastapi import FastAPI, Depends, HTTPException, Security, Request, Query
+from fastapi import Header
 
 from fastapi.responses import RedirectResponse
 from fastapi.responses import HTMLResponse
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
+
 
 # this is the part that puts the lock icon to the docs
 from fastapi.security import APIKeyCookie
 
-# pip install fastapi-sso
-from fastapi_sso.sso.google import GoogleSSO
-from fastapi_sso.sso.base import OpenID
+from tortoise.contrib.fastapi import register_tortoise
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
 
-# pip install python-jose
-from jose import jwt
+from pydantic import BaseModel, Field, create_model
 
-from fastapi.templating import Jinja2Templates
+from task_registry import TASK_TYPES, TaskType
+from task_registry import DIVIDE, DivideIn
 
-from tortoise.contrib.fastapi import register_tortoise
+from task_events import hub as task_event_hub
 
-from fastapi.staticfiles import StaticFiles
+from scheduling import fair_share, task_priorities
 
-from pydantic import BaseModel
+from rate_limit import RATE_LIMIT_ENABLED, rate_limiter
 
-from celery.result import AsyncResult
+import metrics
 
-from celery_task import divide as celery_task_divide
-
-from web.db_models import Account, TaskHistory
+from web.cache import TTLCache
+from web import fast_json
+from web.responses import FastJSONResponse
+from web import pages
+from web.pages import RenderedPage
+from web.static_files import PrecompressedStaticFiles
+from web.db_models import Account, TaskHistory, TaskHistoryArchive
+from web.db_models import READY_STATES
 
 from shared import CONFIG
-from shared import DB_URL
+from shared import API_DB_URL, GENERATE_SCHEMAS
 
 
 #############################
@@ -44,9 +62,6 @@ from shared import DB_URL
 #      --- FASTAPI ---      #
 #                           #
 #############################
-templates = Jinja2Templates(directory="web/templates")
-
-
 root_path: str = CONFIG["app"]["ROOT_PATH"]
 
 if root_path != "":
@@ -57,13 +72,19 @@ else:
 
 app = FastAPI(
     root_path=f"/{root_path}",
-    title="NanoSaaS"
+    title="NanoSaaS",
+    default_response_class=FastJSONResponse
 )
 
 
+# Seconds browsers may keep static assets without revalidating them;
+# rename an asset to change it within that time.
+STATIC_MAX_AGE: int = CONFIG["app"].get("STATIC_MAX_AGE", 7 * 86400)
+
 # Mount static files directory
-app.mount("/web/static", StaticFiles(
-        directory="web/static"
+app.mount("/web/static", PrecompressedStaticFiles(
+        directory="web/static",
+        max_age=STATIC_MAX_AGE
     ),
     name="static"
 )
@@ -76,17 +97,16 @@ GOOGLE_CLIENT_SECRET = CONFIG["api"]["GOOGLE_CLIENT_SECRET"]
 GOOGLE_REDIRECT_URI = CONFIG["api"]["GOOGLE_REDIRECT_URI"]
 
 
-google_sso = GoogleSSO(
-    GOOGLE_CLIENT_ID,
-    GOOGLE_CLIENT_SECRET,
-    GOOGLE_REDIRECT_URI
-)
+@functools.cache
+def get_sso():
+    """The Google SSO client, built on the first login."""
+    from fastapi_sso.sso.google import GoogleSSO
 
-sso = GoogleSSO(
-    client_id=GOOGLE_CLIENT_ID,
-    client_secret=GOOGLE_CLIENT_SECRET,
-    redirect_uri=GOOGLE_REDIRECT_URI
-)
+    return GoogleSSO(
+        client_id=GOOGLE_CLIENT_ID,
+        client_secret=GOOGLE_CLIENT_SECRET,
+        redirect_uri=GOOGLE_REDIRECT_URI
+    )
 
 
 ###########################
@@ -106,64 +126,309 @@ class TaskInitOut(BaseModel):
     message: str
 
 
+# Upper bound on the tasks submitted by one batch request.
+BATCH_MAX_SIZE: int = 1000
+
+
+# Longest accepted Idempotency-Key header. Batch tasks store it with a
+# ":<index>" suffix, within TaskHistory.idempotency_key's 255 characters.
+IDEMPOTENCY_KEY_MAX_LENGTH: int = 200
+
+
+# Response model for a batch task initiation, ids in request order.
+class TaskBatchInitOut(BaseModel):
+    ids: list[str]
+    message: str
+
+
+# Response model for the details of one task.
+class TaskDetailsOut(BaseModel):
+    task_id: str
+    task_type: str
+    parameters: dict
+    status: str
+    result: Any = None
+    created_at: datetime.datetime
+
+
+# Response model for one row of a task history page.
+class TaskHistoryItemOut(BaseModel):
+    id: int
+    task_id: str
+    task_type: str
+    parameters: dict
+    status: str
+    result: Any = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+
+# Response model for a task history page.
+class TaskHistoryPageOut(BaseModel):
+    tasks: list[TaskHistoryItemOut]
+    next_cursor: str | None
+    since_cursor: str | None
+    last_updated: datetime.datetime | None
+
+
+HISTORY_PAGE_SIZE: int = 50
+HISTORY_MAX_PAGE_SIZE: int = 200
+
+# Account id -> service tier, re-read after ACCOUNT_TIER_CACHE_TTL.
+ACCOUNT_TIER_CACHE_SIZE: int = 10_000
+ACCOUNT_TIER_CACHE_TTL: float = 60.0
+
+account_tier_cache = TTLCache(
+    maxsize=ACCOUNT_TIER_CACHE_SIZE,
+    ttl=ACCOUNT_TIER_CACHE_TTL
+)
+
+# Results of memoized task types by TaskType.params_hash. Misses fall
+# back to TaskHistory, which every API process shares.
+RESULT_CACHE_SIZE: int = 10_000
+RESULT_CACHE_TTL: float = 3600.0
+
+result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+# Debug/CI check of the ORM queries of each request: "off", "log" to
+# print the routes over their budget or repeating a statement at least
+# N_PLUS_ONE_THRESHOLD times (N+1), "strict" to also fail them with 500.
+QUERY_BUDGET_MODE: str = CONFIG.get("debug", {}).get("query_budget", "off")
+N_PLUS_ONE_THRESHOLD: int = CONFIG.get("debug", {}).get(
+    "n_plus_one_threshold", 3
+)
+
+# Most queries a request may issue, by (method, route), caches cold and
+# tokens without an account id. Every route is listed, see
+# tests/test_query_budgets.py; task submission routes are added with them.
+QUERY_BUDGETS: dict[tuple[str, str], int] = {
+    ("GET", "/"): 0,
+    ("GET", "/thankyou"): 0,
+    ("GET", "/auth/login"): 0,
+    ("GET", "/auth/logout"): 0,
+    ("GET", "/user/api_key_page"): 0,
+    ("GET", "/userpanel"): 0,
+    ("GET", "/metrics"): 0,
+    ("GET", "/auth/callback"): 2,
+    ("GET", "/user/credits"): 2,
+    ("GET", "/api/user_credits"): 2,
+    ("GET", "/user/task_history"): 2,
+    ("GET", "/user/api_key"): 2,
+    ("POST", "/user/api_key"): 3,
+    ("GET", "/task/divide/{x}/{y}"): 6,
+    ("GET", "/api/task/divide/{x}/{y}"): 6,
+    ("GET", "/task_details/{task_id}"): 1,
+    # Tasks missing from TaskHistory are looked up in the archive.
+    ("GET", "/task/status/{task_id}"): 3,
+    ("GET", "/api/task/status/{task_id}"): 3,
+    # Long polls re-read the task after each of its status events.
+    ("GET", "/api/task_details_from_user/{task_id}"): 5,
+    ("GET", "/api/task_details/{task_id}"): 5,
+    ("GET", "/user/task_events"): 1,
+    ("GET", "/task/events/{task_id}"): 2,
+}
+
+# Cache-Control of tasks that may still change, and of finished ones.
+CACHE_CONTROL_REVALIDATE: str = "private, no-cache"
+CACHE_CONTROL_FINISHED: str = "private, max-age=86400, immutable"
+# Cache-Control of the HTML pages anyone may load.
+CACHE_CONTROL_PUBLIC_PAGE: str = "public, no-cache"
+
+# Pages that only depend on the config, rendered once per process.
+STATIC_PAGES: tuple[str, ...] = (
+    "login.html",
+    "thankyou.html",
+    "api_key_page.html",
+    "user_panel.html",
+)
+
+# Longest `wait` of a long-polling task details request, in seconds.
+LONG_POLL_MAX_WAIT: float = 60.0
+
+# Seconds of silence after which an event stream sends a keepalive.
+EVENT_STREAM_KEEPALIVE: float = 15.0
+
+
 ###########################
 #                         #
 #      --- LOGIN ---      #
 #                         #
 ###########################
+API_KEY_PREFIX_LENGTH: int = 8
+
+# API key hash -> account id. Rotations invalidate the local entry,
+# other processes drop it after at most API_KEY_CACHE_TTL seconds.
+API_KEY_CACHE_SIZE: int = 10_000
+API_KEY_CACHE_TTL: float = 60.0
+
+api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+
+
 def generate_api_key():
     return secrets.token_hex(32)  # Generates a 64-character API key
 
 
-async def get_logged_user(
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def get_api_account_id(api_key: str) -> int:
+    """
+    Resolve the `api_key` query parameter to its account id.
+
+    Cached keys are authenticated without touching the database.
+    """
+    key_hash = hash_api_key(api_key)
+    account_id = api_key_cache.get(key_hash)
+    if account_id is not None:
+        return account_id
+
+    account_ids = await Account.filter(
+        api_key_hash=key_hash
+    ).values_list("id", flat=True)
+    if not account_ids:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    api_key_cache.set(key_hash, account_ids[0])
+    return account_ids[0]
+
+
+# SHA-256 of a JWT -> its verified claims, kept until the token expires.
+JWT_CACHE_SIZE: int = 10_000
+JWT_CACHE_MAX_TTL: float = 300.0
+
+jwt_claims_cache = TTLCache(maxsize=JWT_CACHE_SIZE, ttl=JWT_CACHE_MAX_TTL)
+
+
+async def get_logged_claims(
     cookie: str = Security(APIKeyCookie(name="token"))
-        ) -> OpenID:
+        ) -> dict:
     """
-    Get user's JWT stored in cookie 'token',
-    parse it and return the user's OpenID.
+    Get user's JWT stored in cookie 'token' and return its verified claims.
+
+    Verified claims are cached by the hash of the whole token, never past
+    `exp`: any other token, even one reusing a cached signature, is
+    verified again.
     """
+    token_hash = hashlib.sha256(cookie.encode()).hexdigest()
+    claims = jwt_claims_cache.get(token_hash)
+    if claims is not None:
+        return claims
+
+    # pip install python-jose
+    from jose import jwt
+
     try:
         claims = jwt.decode(
             cookie,
             key=JWT_SIGNING_SECRET_KEY,
             algorithms=["HS256"]
         )
-        return OpenID(**claims["pld"])
     except Exception as error:
-        print("Error.")
-        print(error)
+        metrics.ERRORS.labels("jwt_decode").inc()
         raise HTTPException(
             status_code=401,
             detail="Invalid authentication credentials"
         ) from error
 
+    ttl = min(claims["exp"] - time.time(), JWT_CACHE_MAX_TTL)
+    jwt_claims_cache.set(token_hash, claims, ttl=ttl)
+    return claims
+
+
+async def get_logged_account_id(
+    claims: dict = Depends(get_logged_claims)
+        ) -> int:
+    """
+    Return the logged user's account id from the token's `aid` claim.
+
+    Tokens issued before the claim existed are resolved once by google_id
+    and the result is kept with their cached claims.
+    """
+    account_id = claims.get("aid")
+    if account_id is None:
+        account_ids = await Account.filter(
+            google_id=claims["sub"]
+        ).values_list("id", flat=True)
+        if not account_ids:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid authentication credentials"
+            )
+        account_id = claims["aid"] = account_ids[0]
+    return account_id
+
+
+async def get_logged_account(
+    account_id: int = Depends(get_logged_account_id)
+        ) -> Account:
+    """Return the logged user's Account row."""
+    return await Account.get(id=account_id)
+
+
+@functools.cache
+def get_static_page(name: str) -> RenderedPage:
+    """A page of STATIC_PAGES, rendered on first use."""
+    return pages.render_page(name, root_prefix=root_prefix)
+
+
+def page_response(
+    request: Request,
+    page: RenderedPage,
+    cache_control: str
+        ) -> Response:
+    """
+    Serve a pre-rendered page, compressed if the client accepts it, or
+    304 Not Modified if the client's copy is current.
+    """
+    headers = {
+        "ETag": page.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding"
+    }
+    if is_not_modified(request, page.etag, None):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = page.negotiate(
+        request.headers.get("accept-encoding", "")
+    )
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return HTMLResponse(body, headers=headers)
+
+
+@app.on_event("startup")
+async def prerender_pages():
+    """Render the static pages, and compile the per-task one, up front."""
+    for name in STATIC_PAGES:
+        get_static_page(name)
+    pages.get_environment().get_template("task_details.html")
+
 
 @app.get("/", include_in_schema=False)
 async def home(request: Request):
     """Render the login page."""
-    return templates.TemplateResponse(
-        "login.html", {
-                "request": request,
-                "root_prefix": root_prefix
-            }
-        )
+    return page_response(
+        request,
+        get_static_page("login.html"),
+        CACHE_CONTROL_PUBLIC_PAGE
+    )
 
 
 @app.get("/thankyou", response_class=HTMLResponse)
 async def thankyou(request: Request):
     """Forget the user's session and return an HTML response."""
-    response = templates.TemplateResponse(
-        "thankyou.html", {
-            "request": request,
-            "root_prefix": root_prefix
-        }
+    return page_response(
+        request,
+        get_static_page("thankyou.html"),
+        CACHE_CONTROL_PUBLIC_PAGE
     )
-    return response
 
 
 @app.get("/auth/login")
 async def login():
     """Redirect the user to the Google login page."""
+    sso = get_sso()
     async with sso:
         return await sso.get_login_redirect()
 
@@ -179,6 +444,9 @@ async def logout(request: Request):
 @app.get("/auth/callback")
 async def login_callback(request: Request):
     """Process login and redirect the user to the protected endpoint."""
+    from jose import jwt
+
+    sso = get_sso()
     async with sso:
         openid = await sso.verify_and_process(request)
         if not openid:
@@ -208,7 +476,8 @@ async def login_callback(request: Request):
         {
             "pld": openid.model_dump(),
             "exp": expiration,
-            "sub": openid.id
+            "sub": openid.id,
+            "aid": account.id
         },
         key=JWT_SIGNING_SECRET_KEY,
         algorithm="HS256"
@@ -224,14 +493,15 @@ async def login_callback(request: Request):
 #                             #
 ###############################
 @app.get("/user/credits")
-async def check_credits(user: OpenID = Depends(get_logged_user)):
+async def check_credits(account: Account = Depends(get_logged_account)):
     """Check the logged user's remaining credits."""
-    account = await Account.get(google_id=user.id)
     return {"credits": account.credits}
 
 
 @app.get("/api/user_credits", response_model=dict)
-async def get_user_credits_with_key(api_key: str):
+async def get_user_credits_with_key(
+    account_id: int = Depends(get_api_account_id)
+        ):
     """
     Get the user's remaining credits using an API key.
 
@@ -241,69 +511,259 @@ async def get_user_credits_with_key(api_key: str):
     Returns:
         dict: The number of remaining credits.
     """
-    account = await Account.get_or_none(api_key=api_key)
-    if not account:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-
+    account = await Account.get(id=account_id)
     return {"credits": account.credits}
 
 
-@app.get("/user/task_history")
-async def task_history(user: OpenID = Depends(get_logged_user)):
-    """Retrieve the logged user's task history."""
-    account = await Account.get(google_id=user.id)
-    history = await TaskHistory.filter(user=account).order_by("-created_at")
+def encode_keyset_cursor(moment: datetime.datetime, task_pk: int) -> str:
+    """Build an opaque keyset cursor pointing right after (moment, task_pk)."""
+    raw = f"{moment.isoformat()}|{task_pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-    for task_row in history:
-        if task_row.status in ["PENDING", "STARTED"]:
-            try:
-                # Get the Celery task status and result
-                result = AsyncResult(task_row.task_id)
-                status = result.status
-                task_row.status = status
 
-                if result.ready():
-                    task_row.result = result.result
+def decode_keyset_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    """Parse a cursor built by `encode_keyset_cursor`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        moment, task_pk = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(moment), int(task_pk)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        ) from error
 
-                await task_row.save()
-            except Exception as e:
-                print(f"Error updating task {task_row.task_id}: {e}")
 
-    # Refresh history after updates
-    history = await TaskHistory.filter(user=account).order_by("-created_at")
-    return [
-        {
-            "id": task.id,
-            "task_id": task.task_id,
-            "task_type": task.task_type,
-            "parameters": task.parameters,
-            "status": task.status,
-            "result": task.result,
-            "created_at": task.created_at
+def encode_history_cursor(task: TaskHistory | TaskHistoryArchive) -> str:
+    """Cursor of the history page following `task`, newest first."""
+    return encode_keyset_cursor(task.created_at, task.id)
+
+
+def encode_delta_cursor(task: TaskHistory | TaskHistoryArchive) -> str:
+    """Cursor of the changes made after `task`'s last update."""
+    return encode_keyset_cursor(task.updated_at, task.id)
+
+
+def http_date(moment: datetime.datetime) -> str:
+    return email.utils.format_datetime(
+        moment.astimezone(datetime.timezone.utc),
+        usegmt=True
+    )
+
+
+def is_not_modified(
+    request: Request,
+    etag: str,
+    last_modified: datetime.datetime | None
+        ) -> bool:
+    """Whether the client's cached copy, per its validators, is current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison: proxies may have weakened the tag.
+        tags = {
+            tag.strip().removeprefix("W/")
+            for tag in if_none_match.split(",")
         }
-        for task in history
-    ]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        cached_at = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if cached_at.tzinfo is None:
+        cached_at = cached_at.replace(tzinfo=datetime.timezone.utc)
+    # HTTP dates have a one second resolution.
+    return last_modified.replace(microsecond=0) <= cached_at
+
+
+def conditional_json_response(
+    request: Request,
+    etag: str,
+    last_modified: datetime.datetime | None,
+    cache_control: str,
+    build_content
+        ) -> Response:
+    """
+    Answer 304 Not Modified if the client's copy is current.
+
+    Otherwise call `build_content` and return it as JSON, so unchanged
+    payloads are never serialized.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(build_content(), headers=headers)
+
+
+def task_etag(task: TaskHistory | TaskHistoryArchive) -> str:
+    """Validator of one task: its `updated_at` changes with every write."""
+    return f'"{task.task_id}-{task.updated_at.timestamp():.6f}"'
+
+
+def task_cache_control(task: TaskHistory | TaskHistoryArchive) -> str:
+    if task.status in READY_STATES:
+        return CACHE_CONTROL_FINISHED
+    return CACHE_CONTROL_REVALIDATE
+
+
+@app.get("/user/task_history", response_model=TaskHistoryPageOut)
+async def task_history(
+    request: Request,
+    cursor: str | None = None,
+    since: datetime.datetime | None = None,
+    since_cursor: str | None = None,
+    limit: int = Query(
+        default=HISTORY_PAGE_SIZE,
+        ge=1,
+        le=HISTORY_MAX_PAGE_SIZE
+    ),
+    archived: bool = False,
+    account_id: int = Depends(get_logged_account_id)
+        ):
+    """
+    Retrieve a page of the logged user's task history.
+
+    Only tasks younger than the archival age are listed; pass
+    `archived=true` to page through the older, archived tasks instead.
+
+    Without `since` or `since_cursor`, rows are returned newest first;
+    pass the returned `next_cursor` back as `cursor` to fetch the
+    following page.
+    With `since`, only rows updated after that instant are returned,
+    oldest change first, so pollers can fetch just the deltas. Pages
+    carry a `since_cursor` to continue from: passed back, it returns the
+    rows changed after the page's latest one, including rows updated at
+    the same instant that did not fit in the page.
+
+    Pages carry an ETag over their rows' versions; a poll whose page did
+    not change is answered 304 Not Modified.
+    """
+    model = TaskHistoryArchive if archived else TaskHistory
+    query = model.filter(user_id=account_id)
+    next_cursor = None
+
+    if since_cursor is not None:
+        updated_at, task_pk = decode_keyset_cursor(since_cursor)
+        history = await query.filter(
+            Q(updated_at__gt=updated_at)
+            | Q(updated_at=updated_at, id__gt=task_pk)
+        ).order_by("updated_at", "id").limit(limit)
+    elif since is not None:
+        history = await query.filter(
+            updated_at__gt=since
+        ).order_by("updated_at", "id").limit(limit)
+    else:
+        if cursor is not None:
+            created_at, task_pk = decode_keyset_cursor(cursor)
+            query = query.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=task_pk)
+            )
+
+        # Fetch one extra row to know whether another page exists.
+        history = await query.order_by(
+            "-created_at", "-id"
+        ).limit(limit + 1)
+        if len(history) > limit:
+            history = history[:limit]
+            next_cursor = encode_history_cursor(history[-1])
+
+    latest = max(
+        history,
+        key=lambda task: (task.updated_at, task.id),
+        default=None
+    )
+    if latest is not None:
+        last_updated = latest.updated_at
+        since_cursor = encode_delta_cursor(latest)
+    else:
+        # Nothing changed past the requested position, which is kept.
+        last_updated = updated_at if since_cursor is not None else since
+
+    versions = "|".join(
+        f"{task.id}:{task.updated_at.timestamp():.6f}" for task in history
+    )
+    etag = hashlib.sha256(
+        f"{versions}|{next_cursor}|{since_cursor}".encode()
+    ).hexdigest()[:32]
+
+    return conditional_json_response(
+        request,
+        f'"{etag}"',
+        last_updated,
+        CACHE_CONTROL_REVALIDATE,
+        lambda: build_task_history_page(
+            history,
+            next_cursor,
+            since_cursor,
+            last_updated
+        )
+    )
+
+
+def build_task_history_page(
+    history: list[TaskHistory] | list[TaskHistoryArchive],
+    next_cursor: str | None,
+    since_cursor: str | None,
+    last_updated: datetime.datetime | None
+        ) -> dict:
+    """
+    A TaskHistoryPageOut as plain data: FastJSONResponse encodes the
+    rows directly, without validating each one through the model.
+    """
+    return {
+        "tasks": [
+            {
+                "id": task.id,
+                "task_id": task.task_id,
+                "task_type": task.task_type,
+                "parameters": task.parameters,
+                "status": task.status,
+                "result": task.result,
+                "created_at": task.created_at,
+                "updated_at": task.updated_at
+            }
+            for task in history
+        ],
+        "next_cursor": next_cursor,
+        "since_cursor": since_cursor,
+        "last_updated": last_updated
+    }
 
 
 @app.get("/user/api_key", response_model=dict)
-async def get_api_key(user: OpenID = Depends(get_logged_user)):
+async def get_api_key(account: Account = Depends(get_logged_account)):
     """
-    Fetch the current API key for the logged-in user.
+    Fetch the prefix of the logged-in user's current API key.
+
+    Only a hash of the key is stored, so the full key cannot be shown again.
     """
-    account = await Account.get(google_id=user.id)
-    return {"api_key": account.api_key}
+    return {"api_key_prefix": account.api_key_prefix}
 
 
 @app.post("/user/api_key", response_model=dict)
 async def create_or_regenerate_api_key(
-    user: OpenID = Depends(get_logged_user)
+    account: Account = Depends(get_logged_account)
         ):
-    account = await Account.get(google_id=user.id)
+    """
+    Generate a new API key for the logged-in user, revoking the old one.
+
+    This is the only response that contains the full key.
+    """
+    if account.api_key_hash is not None:
+        api_key_cache.pop(account.api_key_hash)
 
     # Generate a new API key
     new_api_key = generate_api_key()
-    account.api_key = new_api_key
-    await account.save()
+    account.api_key_hash = hash_api_key(new_api_key)
+    account.api_key_prefix = new_api_key[:API_KEY_PREFIX_LENGTH]
+    await account.save(update_fields=["api_key_hash", "api_key_prefix"])
 
     return {"api_key": new_api_key}
 
@@ -311,17 +771,15 @@ async def create_or_regenerate_api_key(
 @app.get("/user/api_key_page", response_class=HTMLResponse)
 async def api_key_page(
     request: Request,
-    user: OpenID = Depends(get_logged_user)
+    claims: dict = Depends(get_logged_claims)
         ):
     """
-    Serve the API key management page.
+    Serve the API key management page to logged-in users.
     """
-    return templates.TemplateResponse(
-        "api_key_page.html",
-        {
-            "request": request,
-            "root_prefix": root_prefix
-        }
+    return page_response(
+        request,
+        get_static_page("api_key_page.html"),
+        CACHE_CONTROL_REVALIDATE
     )
 
 
@@ -333,13 +791,12 @@ async def api_key_page(
 @app.get("/userpanel", response_class=HTMLResponse)
 async def serve_page(
     request: Request,
-    user: OpenID = Depends(get_logged_user)
+    claims: dict = Depends(get_logged_claims)
         ):
-    return templates.TemplateResponse(
-        "user_panel.html", {
-            "request": request,
-            "root_prefix": root_prefix
-        }
+    return page_response(
+        request,
+        get_static_page("user_panel.html"),
+        CACHE_CONTROL_REVALIDATE
     )
 
 
@@ -348,34 +805,446 @@ async def serve_page(
 #      --- TASKS ---      #
 #                         #
 ###########################
-@app.get("/task/divide/{x}/{y}", response_model=TaskInitOut)
-async def divide(
-    x: int,
-    y: int,
-    user: OpenID = Depends(get_logged_user)
-        ):
-    account = await Account.get(google_id=user.id)
-    if account.credits < 1:
+async def get_account_tier(account_id: int) -> str:
+    """Return the account's service tier, cached for a short while."""
+    tier = account_tier_cache.get(account_id)
+    if tier is None:
+        tiers = await Account.filter(id=account_id).values_list(
+            "tier",
+            flat=True
+        )
+        tier = tiers[0] if tiers else "free"
+        account_tier_cache.set(account_id, tier)
+    return tier
+
+
+async def dispatch_priorities(
+    account_id: int,
+    task_type: TaskType,
+    count: int
+        ) -> list[int]:
+    """Celery priority of each of `count` tasks about to be published."""
+    return await task_priorities(
+        fair_share,
+        account_id,
+        await get_account_tier(account_id),
+        count,
+        priority=task_type.priority
+    )
+
+
+async def get_idempotency_key(
+    idempotency_key: str | None = Header(
+        default=None,
+        max_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    )
+        ) -> str | None:
+    """Return the request's optional `Idempotency-Key` header."""
+    return idempotency_key
+
+
+async def find_idempotent_tasks(
+    account_id: int,
+    task_type: TaskType,
+    keys: list[str],
+    params_list: list[BaseModel]
+        ) -> list[str] | None:
+    """
+    Ids of the tasks already submitted under idempotency `keys`.
+
+    Returns None if none was. Reusing keys for a different request is
+    refused with a 409.
+    """
+    rows = await TaskHistory.filter(
+        user_id=account_id,
+        idempotency_key__in=keys
+    ).values("idempotency_key", "task_id", "task_type", "parameters")
+    if not rows:
+        return None
+
+    by_key = {row["idempotency_key"]: row for row in rows}
+    same_request = len(by_key) == len(keys) and all(
+        by_key[key]["task_type"] == task_type.name
+        and by_key[key]["parameters"] == params.model_dump()
+        for key, params in zip(keys, params_list)
+    )
+    if not same_request:
+        raise HTTPException(
+            status_code=409,
+            detail="Idempotency key already used for a different request"
+        )
+    return [by_key[key]["task_id"] for key in keys]
+
+
+async def find_memoized_results(
+    task_type: TaskType,
+    hashes: list[str]
+        ) -> dict[str, object]:
+    """
+    Results of earlier successful tasks, by `TaskType.params_hash`.
+
+    Results are looked up in this process' cache first, then in the
+    TaskHistory rows shared by every process, younger than the type's
+    `memo_ttl`.
+    """
+    results = {}
+    for params_hash in hashes:
+        # Entries are 1-tuples, a task may return None.
+        entry = result_cache.get(params_hash)
+        if entry is not None:
+            results[params_hash] = entry[0]
+
+    missing = set(hashes) - results.keys()
+    if missing:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        rows = await TaskHistory.filter(
+            params_hash__in=missing,
+            status="SUCCESS",
+            updated_at__gte=now - datetime.timedelta(
+                seconds=task_type.memo_ttl
+            )
+        ).values("params_hash", "result", "updated_at")
+        for row in rows:
+            results[row["params_hash"]] = row["result"]
+            age = (now - row["updated_at"]).total_seconds()
+            result_cache.set(
+                row["params_hash"],
+                (row["result"],),
+                ttl=task_type.memo_ttl - age
+            )
+
+    hits = sum(params_hash in results for params_hash in hashes)
+    metrics.RESULT_MEMO_LOOKUPS.labels("hit").inc(hits)
+    metrics.RESULT_MEMO_LOOKUPS.labels("miss").inc(len(hashes) - hits)
+    return results
+
+
+async def submit_task(
+    account_id: int,
+    task_type: TaskType,
+    params: BaseModel,
+    idempotency_key: str | None = None
+        ) -> str:
+    """
+    Reserve the task's credits, record it and hand it to Celery.
+
+    The history row is written before publishing so the worker always
+    finds the reservation it has to settle. A request retried with the
+    same `idempotency_key` gets the original task id back and is neither
+    charged nor dispatched again. Memoized task types whose result is
+    already known are recorded as done, at their memoized cost, without
+    running.
+    """
+    if idempotency_key is not None:
+        task_ids = await find_idempotent_tasks(
+            account_id, task_type, [idempotency_key], [params]
+        )
+        if task_ids is not None:
+            return task_ids[0]
+
+    params_hash = None
+    memoized = {}
+    if task_type.memoize:
+        params_hash = task_type.params_hash(params)
+        memoized = await find_memoized_results(task_type, [params_hash])
+    hit = params_hash in memoized
+
+    cost = task_type.memo_credit_cost if hit else task_type.credit_cost
+    if not await Account.reserve_credits(account_id, cost):
         raise HTTPException(status_code=403, detail="Not enough credits")
 
+    task_id = str(uuid.uuid4())
+    try:
+        # Save the task in history
+        await TaskHistory.create(
+            user_id=account_id,
+            task_id=task_id,
+            task_type=task_type.name,
+            parameters=params.model_dump(),
+            status="SUCCESS" if hit else "PENDING",
+            result=memoized.get(params_hash),
+            # Memoized results are charged right away.
+            reserved_credits=0 if hit else cost,
+            params_hash=params_hash,
+            idempotency_key=idempotency_key
+        )
+    except IntegrityError:
+        await Account.refund_credits(account_id, cost)
+        if idempotency_key is None:
+            raise
+        # A concurrent retry recorded it first.
+        task_ids = await find_idempotent_tasks(
+            account_id, task_type, [idempotency_key], [params]
+        )
+        if task_ids is None:
+            raise
+        return task_ids[0]
+    except Exception:
+        await Account.refund_credits(account_id, cost)
+        raise
+
+    if hit:
+        return task_id
+
     try:
         # Start the Celery task
-        task = celery_task_divide.delay(x, y, user.id)
+        [priority] = await dispatch_priorities(account_id, task_type, 1)
+        task_type.task.apply_async(
+            kwargs={**params.model_dump(), "account_id": account_id},
+            task_id=task_id,
+            priority=priority,
+            **task_type.publish_options()
+        )
+    except Exception:
+        await TaskHistory.settle_credits(task_id, refund=True)
+        await TaskHistory.filter(task_id=task_id).delete()
+        raise
 
-        # Deduct a credit
-        # account.credits -= 1
-        # await account.save()
+    return task_id
 
-        # Save the task in history
-        await TaskHistory.create(
-            user=account,
-            task_id=task.id,
-            task_type="divide",
-            parameters={"x": x, "y": y},
-            status="PENDING"
+
+async def submit_task_batch(
+    account_id: int,
+    task_type: TaskType,
+    params_list: list[BaseModel],
+    idempotency_key: str | None = None
+        ) -> list[str]:
+    """
+    Submit many tasks of one type with a constant number of round trips.
+
+    All credits are reserved by one UPDATE, the history rows are written
+    by one bulk INSERT and the messages are published as a Celery group
+    over a single broker connection. The batch is accepted or refused as
+    a whole, and retried under the same `idempotency_key` as a whole.
+    Tasks with a memoized result are recorded as done and not published.
+    """
+    keys = [None] * len(params_list)
+    if idempotency_key is not None:
+        keys = [f"{idempotency_key}:{i}" for i in range(len(params_list))]
+        task_ids = await find_idempotent_tasks(
+            account_id, task_type, keys, params_list
+        )
+        if task_ids is not None:
+            return task_ids
+
+    hashes = [None] * len(params_list)
+    memoized = {}
+    if task_type.memoize:
+        hashes = [task_type.params_hash(params) for params in params_list]
+        memoized = await find_memoized_results(task_type, hashes)
+    hits = [params_hash in memoized for params_hash in hashes]
+
+    memo_cost = task_type.memo_credit_cost * sum(hits)
+    cost = memo_cost + task_type.credit_cost * hits.count(False)
+    if not await Account.reserve_credits(account_id, cost):
+        raise HTTPException(status_code=403, detail="Not enough credits")
+
+    task_ids = [str(uuid.uuid4()) for _ in params_list]
+    try:
+        await TaskHistory.bulk_create([
+            TaskHistory(
+                user_id=account_id,
+                task_id=task_id,
+                task_type=task_type.name,
+                parameters=params.model_dump(),
+                status="SUCCESS" if hit else "PENDING",
+                result=memoized.get(params_hash),
+                reserved_credits=0 if hit else task_type.credit_cost,
+                params_hash=params_hash,
+                idempotency_key=key
+            )
+            for task_id, params, params_hash, hit, key in zip(
+                task_ids,
+                params_list,
+                hashes,
+                hits,
+                keys
+            )
+        ])
+    except IntegrityError:
+        await Account.refund_credits(account_id, cost)
+        if idempotency_key is None:
+            raise
+        # A concurrent retry recorded it first.
+        task_ids = await find_idempotent_tasks(
+            account_id, task_type, keys, params_list
+        )
+        if task_ids is None:
+            raise
+        return task_ids
+    except Exception:
+        await Account.refund_credits(account_id, cost)
+        raise
+
+    to_run = [
+        (task_id, params)
+        for task_id, params, hit in zip(task_ids, params_list, hits)
+        if not hit
+    ]
+    if not to_run:
+        return task_ids
+
+    try:
+        priorities = await dispatch_priorities(
+            account_id,
+            task_type,
+            len(to_run)
         )
+        from celery import group
+
+        group(
+            task_type.task.signature(
+                kwargs={**params.model_dump(), "account_id": account_id},
+                task_id=task_id,
+                priority=priority,
+                **task_type.publish_options()
+            )
+            for (task_id, params), priority in zip(to_run, priorities)
+        ).apply_async()
+    except Exception:
+        # Tasks already published find no reservation left to settle.
+        for task_id, _ in to_run:
+            await TaskHistory.settle_credits(task_id, refund=True)
+        await Account.refund_credits(account_id, memo_cost)
+        await TaskHistory.filter(task_id__in=task_ids).delete()
+        raise
+
+    return task_ids
+
+
+def add_task_type_routes(task_type: TaskType) -> None:
+    """
+    Add the submission endpoints of a registered task type.
+
+    POST /task/<name> and /api/task/<name> take the task parameters as a
+    JSON body; their /batch variants take `{"tasks": [...]}`. All honor
+    an optional `Idempotency-Key` header.
+    """
+    # Idempotency, memoization, tier, reservation and insert lookups, plus
+    # authentication; independent of the batch size.
+    for path in (
+        f"/task/{task_type.name}",
+        f"/api/task/{task_type.name}",
+        f"/task/{task_type.name}/batch",
+        f"/api/task/{task_type.name}/batch",
+    ):
+        QUERY_BUDGETS["POST", path] = 6
+
+    Params = task_type.params
+    BatchParams = create_model(
+        f"{Params.__name__}Batch",
+        tasks=(
+            list[Params],
+            Field(min_length=1, max_length=BATCH_MAX_SIZE)
+        )
+    )
+
+    async def submit(
+        account_id: int,
+        params: BaseModel,
+        idempotency_key: str | None
+            ) -> TaskInitOut:
+        try:
+            task_id = await submit_task(
+                account_id,
+                task_type,
+                params,
+                idempotency_key
+            )
+            return TaskInitOut(id=task_id, message="Task started successfully")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Task initiation failed: {e}"
+            )
+
+    async def submit_batch(
+        account_id: int,
+        batch: BaseModel,
+        idempotency_key: str | None
+            ) -> TaskBatchInitOut:
+        try:
+            task_ids = await submit_task_batch(
+                account_id,
+                task_type,
+                batch.tasks,
+                idempotency_key
+            )
+            return TaskBatchInitOut(
+                ids=task_ids,
+                message=f"{len(task_ids)} tasks started successfully"
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Task initiation failed: {e}"
+            )
+
+    @app.post(f"/task/{task_type.name}", response_model=TaskInitOut)
+    async def submit_with_session(
+        params: Params,
+        account_id: int = Depends(get_logged_account_id),
+        idempotency_key: str | None = Depends(get_idempotency_key)
+            ):
+        return await submit(account_id, params, idempotency_key)
+
+    @app.post(f"/api/task/{task_type.name}", response_model=TaskInitOut)
+    async def submit_with_api_key(
+        params: Params,
+        account_id: int = Depends(get_api_account_id),
+        idempotency_key: str | None = Depends(get_idempotency_key)
+            ):
+        return await submit(account_id, params, idempotency_key)
+
+    @app.post(
+        f"/task/{task_type.name}/batch",
+        response_model=TaskBatchInitOut
+    )
+    async def submit_batch_with_session(
+        batch: BatchParams,
+        account_id: int = Depends(get_logged_account_id),
+        idempotency_key: str | None = Depends(get_idempotency_key)
+            ):
+        return await submit_batch(account_id, batch, idempotency_key)
+
+    @app.post(
+        f"/api/task/{task_type.name}/batch",
+        response_model=TaskBatchInitOut
+    )
+    async def submit_batch_with_api_key(
+        batch: BatchParams,
+        account_id: int = Depends(get_api_account_id),
+        idempotency_key: str | None = Depends(get_idempotency_key)
+            ):
+        return await submit_batch(account_id, batch, idempotency_key)
+
+
+for registered_task_type in TASK_TYPES.values():
+    add_task_type_routes(registered_task_type)
 
-        return TaskInitOut(id=task.id, message="Task started successfully")
+
+# Path-parameter shortcuts kept for existing clients.
+@app.get("/task/divide/{x}/{y}", response_model=TaskInitOut)
+async def divide(
+    x: int,
+    y: int,
+    account_id: int = Depends(get_logged_account_id),
+    idempotency_key: str | None = Depends(get_idempotency_key)
+        ):
+    try:
+        task_id = await submit_task(
+            account_id,
+            DIVIDE,
+            DivideIn(x=x, y=y),
+            idempotency_key
+        )
+        return TaskInitOut(id=task_id, message="Task started successfully")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -384,7 +1253,12 @@ async def divide(
 
 
 @app.get("/api/task/divide/{x}/{y}", response_model=TaskInitOut)
-async def divide_with_api_key(x: int, y: int, api_key: str):
+async def divide_with_api_key(
+    x: int,
+    y: int,
+    account_id: int = Depends(get_api_account_id),
+    idempotency_key: str | None = Depends(get_idempotency_key)
+        ):
     """
     Endpoint for initiating a division task using an API key.
 
@@ -392,36 +1266,22 @@ async def divide_with_api_key(x: int, y: int, api_key: str):
         x (int): Dividend.
         y (int): Divisor.
         api_key (str): User's API key for authentication.
+        Idempotency-Key (header, optional): Retries carrying the same key
+            return the original task instead of starting a new one.
 
     Returns:
         TaskInitOut: Details about the initiated task.
     """
-    # Validate API key
-    account = await Account.get_or_none(api_key=api_key)
-    if not account:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-
-    if account.credits < 1:
-        raise HTTPException(status_code=403, detail="Not enough credits")
-
     try:
-        # Start the Celery task
-        task = celery_task_divide.delay(x, y, account.id)
-
-        # Deduct a credit
-        # account.credits -= 1
-        # await account.save()
-
-        # Save the task in history
-        await TaskHistory.create(
-            user=account,
-            task_id=task.id,
-            task_type="divide",
-            parameters={"x": x, "y": y},
-            status="PENDING"
+        task_id = await submit_task(
+            account_id,
+            DIVIDE,
+            DivideIn(x=x, y=y),
+            idempotency_key
         )
-
-        return TaskInitOut(id=task.id, message="Task started successfully")
+        return TaskInitOut(id=task_id, message="Task started successfully")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -429,32 +1289,38 @@ async def divide_with_api_key(x: int, y: int, api_key: str):
         )
 
 
-@app.get("/task/status/{task_id}", response_model=TaskOut)
-async def get_status(task_id: str, user: OpenID = Depends(get_logged_user)):
-    """Get the status of a specific task."""
-    try:
-        # Fetch the task from the database
-        # and ensure it belongs to the logged-in user
-        task_history = await TaskHistory.get(
+async def get_account_task(
+    task_id: str,
+    account_id: int
+        ) -> TaskHistory | TaskHistoryArchive | None:
+    """
+    A task of `account_id`, looked up in the archive if it is no longer
+    in TaskHistory, or None.
+    """
+    task = await TaskHistory.get_or_none(task_id=task_id, user_id=account_id)
+    if task is None:
+        task = await TaskHistoryArchive.get_or_none(
             task_id=task_id,
-            user__google_id=user.id
+            user_id=account_id
         )
+    return task
 
-        # Update the task status and result
-        result = AsyncResult(task_id)
-        task_history.status = result.status
 
-        if result.ready():
-            task_history.result = result.result
-
-        await task_history.save()
+async def fetch_task_status(task_id: str, account_id: int) -> TaskOut:
+    """Status of a task of any type, if it belongs to `account_id`."""
+    try:
+        # Fetch the task from the database
+        # and ensure it belongs to the account
+        task_history = await get_account_task(task_id, account_id)
+        if task_history is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Task not found or you do not have permission to access it"
+            )
 
         return TaskOut(id=task_id, status=task_history.status)
-    except TaskHistory.DoesNotExist:
-        raise HTTPException(
-            status_code=404,
-            detail="Task not found or you do not have permission to access it"
-        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -462,85 +1328,143 @@ async def get_status(task_id: str, user: OpenID = Depends(get_logged_user)):
         )
 
 
+@app.get("/task/status/{task_id}", response_model=TaskOut)
+async def get_status(
+    task_id: str,
+    account_id: int = Depends(get_logged_account_id)
+        ):
+    """Get the status of a specific task."""
+    return await fetch_task_status(task_id, account_id)
+
+
+@app.get("/api/task/status/{task_id}", response_model=TaskOut)
+async def get_status_with_api_key(
+    task_id: str,
+    account_id: int = Depends(get_api_account_id)
+        ):
+    """
+    Get the status of a specific task using an API key.
+
+    Args:
+        task_id (str): The ID of the task.
+        api_key (str): User's API key for authentication.
+
+    Returns:
+        TaskOut: The task's current status.
+    """
+    return await fetch_task_status(task_id, account_id)
+
+
 @app.get("/task_details/{task_id}", response_class=HTMLResponse)
 async def render_task_details_page(
-    task_id: str,
-    request: Request,
-    user: OpenID = Depends(get_logged_user)
+    task_id: uuid.UUID,
+    account_id: int = Depends(get_logged_account_id)
         ):
     """
     Render the task details page for the given task ID using a Jinja2 template.
+
+    The page holds nothing but the task ID: the task is loaded by the
+    page from the details and events endpoints, which check that it
+    belongs to the logged-in user, so rendering needs no query. Task IDs
+    are UUIDs, which is all the page's script will accept.
     """
-    try:
-        # Fetch the task and ensure it belongs to the logged-in user
-        task = await TaskHistory.get(
-            task_id=task_id,
-            user__google_id=user.id
-        )
+    return HTMLResponse(pages.render(
+        "task_details.html",
+        task_id=str(task_id),
+        root_prefix=root_prefix
+    ))
+
+
+async def wait_for_task_change(
+    task: TaskHistory,
+    wait: float,
+    events: asyncio.Queue
+        ) -> TaskHistory:
+    """
+    Return the task once it finished, or after `wait` seconds.
 
-        return templates.TemplateResponse(
-            "task_details.html",
-            {
-                "request": request,
-                "task_id": task.task_id,
-                "root_prefix": root_prefix
-            }
-        )
+    `events` receives the task's status events and was subscribed to
+    before `task` was read, so no transition in between is missed. The
+    row is only re-read after a finishing event, or at the end of a wait
+    that saw others: STARTED is written to it only when results live in
+    the database.
+    """
+    if wait <= 0 or task.status in READY_STATES:
+        return task
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    changed = False
+    while (remaining := deadline - loop.time()) > 0:
+        try:
+            event = await asyncio.wait_for(events.get(), remaining)
+        except asyncio.TimeoutError:
+            break
+        changed = True
+        if event["status"] in READY_STATES:
+            break
+
+    if changed:
+        await task.refresh_from_db()
+    return task
+
+
+def task_details_response(
+    request: Request,
+    task: TaskHistory | TaskHistoryArchive
+        ) -> Response:
+    """
+    Task details as JSON, validated by the task's version.
 
-    except TaskHistory.DoesNotExist:
-        raise HTTPException(
-            status_code=404,
-            detail="Task not found or you do not have permission to access it"
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving task details: {e}"
-        )
+    Finished tasks never change, so clients may keep them for a day.
+    """
+    return conditional_json_response(
+        request,
+        task_etag(task),
+        task.updated_at,
+        task_cache_control(task),
+        lambda: {
+            "task_id": task.task_id,
+            "task_type": task.task_type,
+            "parameters": task.parameters,
+            "status": task.status,
+            "result": task.result,
+            "created_at": task.created_at,
+        }
+    )
 
 
-@app.get("/api/task_details_from_user/{task_id}", response_class=JSONResponse)
+@app.get("/api/task_details_from_user/{task_id}", response_model=TaskDetailsOut)
 async def get_task_details_json_from_user(
     task_id: str,
-    user: OpenID = Depends(get_logged_user)
+    request: Request,
+    wait: float = Query(default=0, ge=0, le=LONG_POLL_MAX_WAIT),
+    account_id: int = Depends(get_logged_account_id)
         ):
     """
     Fetch task details from the database and return them as JSON.
+
+    With `wait`, hold the request until the task's status changes, for
+    at most that many seconds.
     """
     try:
-        # Fetch the task and ensure it belongs to the logged-in user
-        task = await TaskHistory.get(
-            task_id=task_id,
-            user__google_id=user.id
-        )
-
-        # Ensure the task's status and result are up-to-date
-        if task.status in ["PENDING", "STARTED"]:
-            result = AsyncResult(task.task_id)
-            task.status = result.status
-
-            if result.ready():
-                task.result = result.result
-
-            await task.save()
-
-        # Return task details as JSON
-        return JSONResponse(
-            {
-                "task_id": task.task_id,
-                "task_type": task.task_type,
-                "parameters": task.parameters,
-                "status": task.status,
-                "result": task.result,
-                "created_at": task.created_at.isoformat(),
-            }
-        )
-
-    except TaskHistory.DoesNotExist:
-        raise HTTPException(
-            status_code=404,
-            detail="Task not found or you do not have permission to access it"
-        )
+        # Listen before reading, not to miss a change in between
+        with task_event_hub.subscribe(f"task:{task_id}") as events:
+            # Fetch the task and ensure it belongs to the logged-in user
+            task = await get_account_task(task_id, account_id)
+            if task is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Task not found or you do not have permission to access it"
+                )
+
+            task = await wait_for_task_change(task, wait, events)
+
+        # Return task details as JSON, unless the client's are current
+        return task_details_response(request, task)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -548,104 +1472,266 @@ async def get_task_details_json_from_user(
         )
 
 
-@app.get("/api/task_details/{task_id}", response_class=JSONResponse)
-async def get_task_details_json(task_id: str, api_key: str):
+@app.get("/api/task_details/{task_id}", response_model=TaskDetailsOut)
+async def get_task_details_json(
+    task_id: str,
+    request: Request,
+    wait: float = Query(default=0, ge=0, le=LONG_POLL_MAX_WAIT),
+    account_id: int = Depends(get_api_account_id)
+        ):
     """
     Fetch task details from the database using an API key and return them as JSON.
 
     Args:
         task_id (str): The ID of the task to retrieve.
         api_key (str): User's API key for authentication.
+        wait (float, optional): Seconds to hold the request until the
+            task's status changes, instead of polling. Finished tasks
+            are returned right away.
 
     Returns:
-        JSONResponse: Task details in JSON format.
+        TaskDetailsOut: Task details in JSON format.
     """
     try:
-        # Validate API key
-        account = await Account.get_or_none(api_key=api_key)
-        if not account:
-            raise HTTPException(status_code=401, detail="Invalid API key")
-
-        # Fetch the task and ensure it belongs to the account associated with the API key
-        task = await TaskHistory.get_or_none(task_id=task_id, user=account)
-        if not task:
-            raise HTTPException(
-                status_code=404,
-                detail="Task not found or you do not have permission to access it"
-            )
-
-        # Ensure the task's status and result are up-to-date
-        if task.status in ["PENDING", "STARTED"]:
-            result = AsyncResult(task.task_id)
-            task.status = result.status
+        # Listen before reading, not to miss a change in between
+        with task_event_hub.subscribe(f"task:{task_id}") as events:
+            # Fetch the task and ensure it belongs to the account associated with the API key
+            task = await get_account_task(task_id, account_id)
+            if not task:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Task not found or you do not have permission to access it"
+                )
+
+            task = await wait_for_task_change(task, wait, events)
+
+        # Return task details as JSON, unless the client's are current
+        return task_details_response(request, task)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error retrieving task details: {e}"
+        )
 
-            if result.ready():
-                task.result = result.result
 
-            await task.save()
+#################################
+#                               #
+#      --- RATE LIMITS ---      #
+#                               #
+#################################
+@app.middleware("http")
+async def limit_api_key_rate(request: Request, call_next):
+    """
+    Refuse requests of API keys over their rate with 429.
 
-        # Return task details as JSON
-        return JSONResponse(
-            {
-                "task_id": task.task_id,
-                "task_type": task.task_type,
-                "parameters": task.parameters,
-                "status": task.status,
-                "result": task.result,
-                "created_at": task.created_at.isoformat(),
+    Runs before routing, so refused requests never parse their body or
+    resolve their key in the database.
+    """
+    api_key = request.query_params.get("api_key")
+    if not RATE_LIMIT_ENABLED or api_key is None:
+        return await call_next(request)
+
+    if not await rate_limiter.acquire(hash_api_key(api_key)):
+        metrics.RATE_LIMITED.inc()
+        return FastJSONResponse(
+            status_code=429,
+            content={"detail": "Rate limit exceeded"},
+            headers={
+                "Retry-After": str(math.ceil(rate_limiter.retry_after))
             }
         )
+    return await call_next(request)
 
-    except Exception as e:
+
+#############################
+#                           #
+#      --- METRICS ---      #
+#                           #
+#############################
+def check_query_budget(
+    method: str,
+    route: str,
+    queries: metrics.QueryStats
+        ) -> str | None:
+    """Describe how a request overran its query budget, if it did."""
+    budget = QUERY_BUDGETS.get((method, route), 0)
+    problems = []
+    if queries.count > budget:
+        problems.append(f"{queries.count} queries, budget {budget}")
+    for sql, count in queries.repeated_statements(N_PLUS_ONE_THRESHOLD):
+        problems.append(f"{count}x {sql}")
+    if not problems:
+        return None
+
+    violation = f"{method} {route}: " + "; ".join(problems)
+    print(f"Query budget exceeded: {violation}")
+    return violation
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Time each request and count its database queries, by route.
+
+    Outside "off" QUERY_BUDGET_MODE, the queries are checked against the
+    route's budget.
+    """
+    start = time.perf_counter()
+    status = 500
+    with metrics.track_queries(
+        record_statements=QUERY_BUDGET_MODE != "off"
+    ) as queries:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            # Route templates, not raw paths, keep the label set bounded.
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            metrics.HTTP_REQUEST_SECONDS.labels(
+                request.method, route, status
+            ).observe(time.perf_counter() - start)
+            metrics.HTTP_REQUEST_DB_QUERIES.labels(
+                request.method, route
+            ).observe(queries.count)
+
+    if QUERY_BUDGET_MODE != "off":
+        violation = check_query_budget(request.method, route, queries)
+        if violation is not None and QUERY_BUDGET_MODE == "strict":
+            return FastJSONResponse(
+                status_code=500,
+                content={"detail": f"Query budget exceeded: {violation}"}
+            )
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+async def export_metrics():
+    """Prometheus metrics of the API, and of the workers if shared."""
+    content, content_type = metrics.render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+############################
+#                          #
+#      --- EVENTS ---      #
+#                          #
+############################
+async def stream_task_events(request: Request, key: str):
+    """Relay the hub events published under `key` as Server-Sent Events."""
+    with task_event_hub.subscribe(key) as queue:
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(),
+                    timeout=EVENT_STREAM_KEEPALIVE
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            yield f"data: {fast_json.dumps(event)}\n\n"
+
+
+@app.get("/user/task_events")
+async def user_task_events(
+    request: Request,
+    account_id: int = Depends(get_logged_account_id)
+        ):
+    """Stream status transitions of every task of the logged user."""
+    return StreamingResponse(
+        stream_task_events(request, f"account:{account_id}"),
+        media_type="text/event-stream"
+    )
+
+
+@app.get("/task/events/{task_id}")
+async def task_events(
+    task_id: str,
+    request: Request,
+    account_id: int = Depends(get_logged_account_id)
+        ):
+    """Stream status transitions of one task of the logged user."""
+    # Archived tasks are finished: their stream only sends keepalives.
+    task = await get_account_task(task_id, account_id)
+    if task is None:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving task details: {e}"
+            status_code=404,
+            detail="Task not found or you do not have permission to access it"
         )
 
+    return StreamingResponse(
+        stream_task_events(request, f"task:{task_id}"),
+        media_type="text/event-stream"
+    )
+
+
+@app.on_event("startup")
+async def start_task_event_hub():
+    await task_event_hub.start()
+
+
+@app.on_event("shutdown")
+async def stop_task_event_hub():
+    await task_event_hub.stop()
+
 
 ##############################
 #                            #
 #      --- DATABASE ---      #
 #                            #
 ##############################
-# Register Tortoise with SQLite
+# Each API process opens its own pool on startup. Tables are created by
+# `python -m scripts.migrate_db`, unless GENERATE_SCHEMAS is set.
 register_tortoise(
     app,
-    db_url=DB_URL,
+    db_url=API_DB_URL,
     modules={"models": ["web.db_models"]},
-    generate_schemas=True,
+    generate_schemas=GENERATE_SCHEMAS,
     add_exception_handlers=True
 )
 
 
+# Registered after Tortoise's own startup handler, once connected.
+@app.on_event("startup")
+async def instrument_database():
+    metrics.instrument_tortoise()
+
+
+UVICORN_LOG_CONFIG: dict = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "()": "uvicorn.logging.DefaultFormatter",
+            "fmt": "%(asctime)s - %(levelname)s - %(message)s",
+            "datefmt": "%Y-%m-%d %H:%M:%S"
+        }
+    },
+    "handlers": {
+        "default": {
+            "formatter": "default",
+            "class": "logging.StreamHandler",
+            "stream": "ext://sys.stdout"
+        }
+    },
+    "loggers": {
+        "uvicorn": {
+            "handlers": ["default"],
+            "level": "INFO"
+        }
+    }
+}
+
+
+# Development server, a single process. In production run serve.py.
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
         app,
         host="127.0.0.1",
         port=51337,
-        log_config={
-            "version": 1,
-            "disable_existing_loggers": False,
-            "formatters": {
-                "default": {
-                    "()": "uvicorn.logging.DefaultFormatter",
-                    "fmt": "%(asctime)s - %(levelname)s - %(message)s",
-                    "datefmt": "%Y-%m-%d %H:%M:%S"
-                }
-            },
-            "handlers": {
-                "default": {
-                    "formatter": "default",
-                    "class": "logging.StreamHandler",
-                    "stream": "ext://sys.stdout"
-                }
-            },
-            "loggers": {
-                "uvicorn": {
-                    "handlers": ["default"],
-                    "level": "INFO"
-                }
-            }
-        }
+        log_config=UVICORN_LOG_CONFIG
     )
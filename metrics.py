@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import contextlib
+import contextvars
+import functools
+import os
+import time
+
+from collections import Counter as StatementCounter
+from dataclasses import dataclass
+
+# pip install prometheus-client
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client import generate_latest, multiprocess
+from prometheus_client import start_http_server
+
+from tortoise import connections
+
+
+# Set to share the metrics of several processes (API workers, Celery
+# prefork children) through files in this directory.
+MULTIPROCESS_DIR: str | None = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Database client methods timed as one query each.
+DB_CLIENT_METHODS: tuple[str, ...] = (
+    "execute_insert",
+    "execute_query",
+    "execute_query_dict",
+    "execute_many",
+    "execute_script",
+)
+
+FAST_BUCKETS: tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5,
+)
+TASK_BUCKETS: tuple[float, ...] = (
+    0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0,
+)
+
+
+#########################
+#                       #
+#      --- API ---      #
+#                       #
+#########################
+HTTP_REQUEST_SECONDS = Histogram(
+    "nanosaas_http_request_duration_seconds",
+    "Time to produce the response headers, by route.",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "nanosaas_http_request_db_queries",
+    "Database queries issued while handling one request, by route.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+DB_QUERY_SECONDS = Histogram(
+    "nanosaas_db_query_duration_seconds",
+    "Duration of database queries, by client method.",
+    ["method"],
+    buckets=FAST_BUCKETS
+)
+RATE_LIMITED = Counter(
+    "nanosaas_rate_limited_total",
+    "Requests refused with 429 Too Many Requests."
+)
+RESULT_MEMO_LOOKUPS = Counter(
+    "nanosaas_result_memo_lookups_total",
+    "Submissions of memoized task types, by whether their result was "
+    "already known (hit) or not (miss).",
+    ["result"]
+)
+RESULT_BACKEND_SECONDS = Histogram(
+    "nanosaas_result_backend_duration_seconds",
+    "Duration of Celery result backend calls, by operation.",
+    ["operation"],
+    buckets=FAST_BUCKETS
+)
+
+
+#############################
+#                           #
+#      --- WORKERS ---      #
+#                           #
+#############################
+TASK_RUNTIME_SECONDS = Histogram(
+    "nanosaas_task_runtime_seconds",
+    "Time between a task starting and finishing, by task and state.",
+    ["task", "state"],
+    buckets=TASK_BUCKETS
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "nanosaas_task_queue_wait_seconds",
+    "Time between a task being published and starting, by task.",
+    ["task"],
+    buckets=TASK_BUCKETS
+)
+RECONCILE_LAG_SECONDS = Histogram(
+    "nanosaas_reconcile_lag_seconds",
+    "Time between a task finishing and its result reaching TaskHistory "
+    "through the reconciler.",
+    buckets=TASK_BUCKETS
+)
+WORKER_DB_INIT_SECONDS = Histogram(
+    "nanosaas_worker_db_init_duration_seconds",
+    "Time for a worker process to open its database pool.",
+    buckets=FAST_BUCKETS
+)
+ERRORS = Counter(
+    "nanosaas_errors_total",
+    "Errors handled without failing the caller, by place.",
+    ["where"]
+)
+
+
+########################
+#                      #
+#      --- DB ---      #
+#                      #
+########################
+@dataclass
+class QueryStats:
+    """Database queries issued in one context (request, task)."""
+    count: int = 0
+    seconds: float = 0.0
+    # Executions of each SQL statement, when recorded.
+    statements: StatementCounter | None = None
+
+    def repeated_statements(self, threshold: int) -> list[tuple[str, int]]:
+        """Statements run at least `threshold` times, a sign of N+1."""
+        if self.statements is None:
+            return []
+        return [
+            (sql, count)
+            for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+# Stats of the request or task being handled, if any.
+current_query_stats: contextvars.ContextVar[QueryStats | None] = (
+    contextvars.ContextVar("current_query_stats", default=None)
+)
+
+
+@contextlib.contextmanager
+def track_queries(record_statements: bool = False):
+    """Count the database queries issued until the block exits."""
+    stats = QueryStats()
+    if record_statements:
+        stats.statements = StatementCounter()
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+
+def timed_query(method, name: str):
+    """Wrap a database client method to time and count its calls."""
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.labels(name).observe(elapsed)
+            stats = current_query_stats.get()
+            if stats is not None:
+                stats.count += 1
+                stats.seconds += elapsed
+                if stats.statements is not None:
+                    # The SQL is the first argument of every method.
+                    sql = args[1] if len(args) > 1 else kwargs.get("query")
+                    stats.statements[str(sql)] += 1
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_db_client(client_class: type) -> None:
+    """
+    Time every query of a Tortoise database client class.
+
+    Tortoise has no query hooks, so the client's execute methods are
+    wrapped in place; instrumenting a class twice is a no-op.
+    """
+    for name in DB_CLIENT_METHODS:
+        method = getattr(client_class, name, None)
+        if method is None or getattr(method, "instrumented", False):
+            continue
+        setattr(client_class, name, timed_query(method, name))
+
+
+def instrument_tortoise() -> None:
+    """
+    Instrument the client classes of every open Tortoise connection,
+    and their subclasses such as the transaction wrappers.
+    """
+    for client in connections.all():
+        client_classes = [type(client)]
+        while client_classes:
+            client_class = client_classes.pop()
+            instrument_db_client(client_class)
+            client_classes.extend(client_class.__subclasses__())
+
+
+############################
+#                          #
+#      --- EXPORT ---      #
+#                          #
+############################
+def metrics_registry() -> CollectorRegistry:
+    """Registry to export: every process' metrics in multiprocess mode."""
+    if MULTIPROCESS_DIR is None:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """The exposition text of the metrics and its content type."""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def serve_metrics(port: int) -> None:
+    """Export the metrics over HTTP from a thread of this process."""
+    start_http_server(port, registry=metrics_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of an exited process, in multiprocess mode."""
+    if MULTIPROCESS_DIR is not None:
+        multiprocess.mark_process_dead(pid)
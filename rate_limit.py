@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+from scheduling import InMemoryTokenBucket, RedisTokenBucket
+from scheduling import get_token_bucket
+
+from shared import CONFIG
+
+from web.cache import TTLCache
+
+import metrics
+
+
+RATE_LIMIT_CONFIG: dict = CONFIG["api"].get("rate_limit", {})
+
+RATE_LIMIT_ENABLED: bool = RATE_LIMIT_CONFIG.get("enabled", True)
+# Per-API-key token bucket: requests per second, and at once.
+RATE_LIMIT_RATE: float = RATE_LIMIT_CONFIG.get("rate", 10.0)
+RATE_LIMIT_BURST: int = RATE_LIMIT_CONFIG.get("burst", 20)
+# Tokens each API process takes from the shared bucket at a time.
+RATE_LIMIT_LEASE: int = min(
+    RATE_LIMIT_CONFIG.get("lease", 5),
+    RATE_LIMIT_BURST
+)
+
+# Prefix of the token bucket keys.
+RATE_LIMIT_KEY_PREFIX: str = "nanosaas:rate_limit:"
+
+# Clients tracked by each process.
+RATE_LIMIT_CACHE_SIZE: int = 10_000
+
+
+class RateLimiter:
+    """
+    Per-client request rate limit over a shared token bucket store.
+
+    Each process leases up to `lease` tokens at a time from the store and
+    spends them locally, so most requests cost no round trip. A client
+    found out of tokens is refused locally until the store has refilled
+    one, so a flood does not reach the store either.
+    """
+
+    def __init__(
+        self,
+        buckets: RedisTokenBucket | InMemoryTokenBucket,
+        rate: float,
+        lease: int
+            ):
+        self.buckets = buckets
+        self.rate = rate
+        self.lease = lease
+        # key -> tokens leased and not spent yet. Unspent leases expire
+        # after the time the store takes to refill them.
+        self._leased = TTLCache(
+            maxsize=RATE_LIMIT_CACHE_SIZE,
+            ttl=lease / rate
+        )
+        # key -> True while the client is out of tokens.
+        self._refused = TTLCache(
+            maxsize=RATE_LIMIT_CACHE_SIZE,
+            ttl=self.retry_after
+        )
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds the store takes to refill one token."""
+        return 1 / self.rate
+
+    async def acquire(self, key: str) -> bool:
+        """Take one token of the client `key`, False if it has none."""
+        tokens = self._leased.get(key, 0)
+        if tokens > 0:
+            self._leased.set(key, tokens - 1)
+            return True
+        if self._refused.get(key, False):
+            return False
+
+        try:
+            granted = await self.buckets.take(key, self.lease)
+        except Exception as e:
+            # Never refuse work because the store is unreachable.
+            metrics.ERRORS.labels("rate_limit").inc()
+            print(f"Rate limit bucket error: {e}")
+            return True
+
+        if granted == 0:
+            self._refused.set(key, True)
+            return False
+        self._leased.set(key, granted - 1)
+        return True
+
+
+rate_limiter = RateLimiter(
+    get_token_bucket(
+        RATE_LIMIT_CONFIG.get("url", CONFIG["celery"]["broker"]),
+        RATE_LIMIT_RATE,
+        RATE_LIMIT_BURST,
+        RATE_LIMIT_KEY_PREFIX
+    ),
+    RATE_LIMIT_RATE,
+    RATE_LIMIT_LEASE
+)
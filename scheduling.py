@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import time
+
+from shared import CONFIG
+
+import metrics
+
+
+# Celery priority of each account tier. Priorities follow the Redis
+# broker: 0 is served first, and by default Redis groups them in the
+# steps 0, 3, 6 and 9.
+TIER_PRIORITIES: dict[str, int] = {
+    "free": 6,
+    "pro": 3,
+    **CONFIG["celery"].get("priorities", {}),
+}
+DEFAULT_TIER: str = "free"
+
+# Priority of the tasks an account submits past its fair share.
+OVERFLOW_PRIORITY: int = TIER_PRIORITIES.pop("overflow", 9)
+
+FAIR_SHARE_CONFIG: dict = CONFIG["celery"].get("fair_share", {})
+
+# Per-account token bucket: tasks dispatched at the tier priority per
+# second, and how many may be dispatched at once.
+FAIR_SHARE_RATE: float = FAIR_SHARE_CONFIG.get("rate", 5.0)
+FAIR_SHARE_BURST: int = FAIR_SHARE_CONFIG.get("burst", 50)
+
+# Prefix of the token bucket keys.
+FAIR_SHARE_KEY_PREFIX: str = "nanosaas:fair_share:"
+
+
+#############################
+#                           #
+#      --- BUCKETS ---      #
+#                           #
+#############################
+# Refill the bucket from the Redis clock, then take up to the requested
+# tokens. Returns how many were granted.
+TAKE_TOKENS_SCRIPT: str = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local granted = math.min(requested, math.floor(tokens))
+redis.call('HSET', KEYS[1], 'tokens', tokens - granted, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return granted
+"""
+
+
+class RedisTokenBucket:
+    """
+    Token buckets kept in Redis, shared by every API process.
+
+    Each take is one atomic script call.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        rate: float,
+        burst: int,
+        key_prefix: str = FAIR_SHARE_KEY_PREFIX
+            ):
+        self.url = url
+        self.rate = rate
+        self.burst = burst
+        self.key_prefix = key_prefix
+        self._client = None
+        self._script = None
+
+    async def take(self, key: str, count: int) -> int:
+        """Take up to `count` tokens from the bucket `key`."""
+        if self._client is None:
+            # pip install redis
+            import redis.asyncio
+
+            self._client = redis.asyncio.Redis.from_url(self.url)
+            self._script = self._client.register_script(TAKE_TOKENS_SCRIPT)
+        granted = await self._script(
+            keys=[self.key_prefix + key],
+            args=[self.rate, self.burst, count]
+        )
+        return int(granted)
+
+
+class InMemoryTokenBucket:
+    """
+    Process-local stand-in for `RedisTokenBucket`.
+
+    Used by tests, simulations and single-process deployments. `clock`
+    returns the current time in seconds.
+    """
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        # key -> (tokens, time of the last refill)
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    async def take(self, key: str, count: int) -> int:
+        now = self.clock()
+        tokens, ts = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + max(0.0, now - ts) * self.rate)
+
+        granted = min(count, int(tokens))
+        self._buckets[key] = (tokens - granted, now)
+        return granted
+
+
+def get_token_bucket(
+    url: str,
+    rate: float = FAIR_SHARE_RATE,
+    burst: int = FAIR_SHARE_BURST,
+    key_prefix: str = FAIR_SHARE_KEY_PREFIX
+        ) -> RedisTokenBucket | InMemoryTokenBucket:
+    """Return the token bucket store matching the scheme of `url`."""
+    if url.startswith("memory://"):
+        return InMemoryTokenBucket(rate, burst)
+    return RedisTokenBucket(url, rate, burst, key_prefix)
+
+
+##################################
+#                                #
+#      --- FAIR SHARING ---      #
+#                                #
+##################################
+async def task_priorities(
+    buckets: RedisTokenBucket | InMemoryTokenBucket,
+    account_id: int,
+    tier: str,
+    count: int,
+    priority: int | None = None
+        ) -> list[int]:
+    """
+    Celery priority of each of `count` tasks submitted by an account.
+
+    Tasks within the account's fair share get `priority`, or its tier's
+    priority when None; the rest are demoted to `OVERFLOW_PRIORITY`, so a
+    client flooding the queue waits behind everybody else's tasks
+    instead of starving them.
+    """
+    if priority is None:
+        priority = TIER_PRIORITIES.get(tier, TIER_PRIORITIES[DEFAULT_TIER])
+
+    try:
+        granted = await buckets.take(f"account:{account_id}", count)
+    except Exception as e:
+        # Scheduling is best effort, never refuse work because of it.
+        metrics.ERRORS.labels("fair_share").inc()
+        print(f"Fair share bucket error: {e}")
+        granted = count
+
+    return [priority] * granted + [OVERFLOW_PRIORITY] * (count - granted)
+
+
+fair_share = get_token_bucket(
+    FAIR_SHARE_CONFIG.get("url", CONFIG["celery"]["broker"])
+)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# Compare serve.py with 1 and N worker processes: time until the API
+# answers its first request, throughput and latency under concurrent
+# clients, and time to drain on SIGTERM.
+#
+# The API runs with its own config: a SQLite file (or --db-url), the
+# in-memory broker and no rate limit. Its tables are created with
+# scripts.migrate_db, then one account with an API key is added.
+#
+# Run from the repository root:
+#   python -m scripts.benchmark_api_processes --workers 1 4 \
+#       --concurrency 64 --requests 5000
+
+import argparse
+import asyncio
+import hashlib
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BENCH_CONFIG: str = """
+[app]
+ROOT_PATH = ""
+
+[api]
+JWT_SIGNING_SECRET_KEY = "benchmark"
+GOOGLE_CLIENT_ID = "benchmark"
+GOOGLE_CLIENT_SECRET = "benchmark"
+GOOGLE_REDIRECT_URI = "http://benchmark/auth/callback"
+
+[api.rate_limit]
+enabled = false
+
+[database]
+DB_HOST = ""
+DB_PORT = ""
+DB_NAME = ""
+DB_USERNAME = ""
+DB_PASSWORD = ""
+DB_URL = "{db_url}"
+
+[celery]
+broker = "memory://"
+backend = "cache+memory://"
+events_url = "memory://"
+results_in_database = true
+
+[celery.fair_share]
+url = "memory://"
+"""
+
+# Routes under load: a pre-rendered page without database access, and an
+# API key request reading the account.
+SCENARIOS: tuple[str, ...] = ("page", "credits")
+
+# Answered 200 without database access or redirects (with an empty
+# ROOT_PATH, "/" redirects).
+PAGE_PATH: str = "/thankyou"
+
+# Seconds to wait for the API to answer before giving up.
+STARTUP_TIMEOUT: float = 60.0
+
+
+async def create_account(api_key: str) -> None:
+    """Add an account with `api_key`, in the database of NANOSAAS_CONFIG."""
+    from tortoise import Tortoise
+
+    from shared import DB_URL
+    from web.db_models import Account
+
+    await Tortoise.init(db_url=DB_URL, modules={"models": ["web.db_models"]})
+    try:
+        await Account.create(
+            google_id="bench",
+            email="bench@example.com",
+            picture="",
+            provider="benchmark",
+            api_key_hash=hashlib.sha256(api_key.encode()).hexdigest()
+        )
+    finally:
+        await Tortoise.close_connections()
+
+
+def prepare_database() -> str:
+    """Create the tables and an account, and return its API key."""
+    subprocess.run(
+        [sys.executable, "-m", "scripts.migrate_db"],
+        check=True
+    )
+    api_key = secrets.token_hex(32)
+    asyncio.run(create_account(api_key))
+    return api_key
+
+
+async def wait_until_up(client, started_at: float) -> float:
+    """Seconds from `started_at` until the API answers."""
+    import httpx
+
+    while time.perf_counter() - started_at < STARTUP_TIMEOUT:
+        try:
+            response = await client.get(PAGE_PATH)
+            if response.status_code == 200:
+                return time.perf_counter() - started_at
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.01)
+    raise TimeoutError("The API did not start")
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_load(client, path: str, requests: int, concurrency: int):
+    """Send `requests` GETs from `concurrency` clients at once."""
+    latencies: list[float] = []
+    errors = 0
+    remaining = requests
+
+    async def run_client():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+async def benchmark_workers(args, api_key: str, workers: int):
+    import httpx
+
+    started_at = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "serve.py",
+            "--port", str(args.port),
+            "--workers", str(workers)
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}",
+            limits=limits,
+            timeout=30.0
+        ) as client:
+            result = {"startup_s": await wait_until_up(client, started_at)}
+            paths = {
+                "page": PAGE_PATH,
+                "credits": f"/api/user_credits?api_key={api_key}",
+            }
+            for name in SCENARIOS:
+                result[name] = await run_load(
+                    client, paths[name], args.requests, args.concurrency
+                )
+    finally:
+        drain_started_at = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    result["drain_s"] = time.perf_counter() - drain_started_at
+    return result
+
+
+def print_report(results: dict[int, dict]) -> None:
+    print(
+        f"{'workers':>7} {'startup s':>10} {'drain s':>8} "
+        f"{'scenario':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'errors':>6}"
+    )
+    for workers, result in results.items():
+        for name in SCENARIOS:
+            load = result[name]
+            print(
+                f"{workers:7d} {result['startup_s']:10.2f} "
+                f"{result['drain_s']:8.2f} {name:>9} "
+                f"{load['throughput']:9.1f} {load['p50_ms']:8.2f} "
+                f"{load['p99_ms']:8.2f} {load['errors']:6d}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1]
+    )
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=51399)
+    parser.add_argument(
+        "--db-url",
+        help="Database of the API, a temporary SQLite file by default."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite://{tmp}/benchmark.sqlite3"
+        config_path = os.path.join(tmp, "config.toml")
+        with open(config_path, "w") as fp:
+            fp.write(BENCH_CONFIG.format(db_url=db_url))
+        # Read by this process and inherited by the API.
+        os.environ["NANOSAAS_CONFIG"] = config_path
+
+        api_key = prepare_database()
+        results = {
+            workers: asyncio.run(
+                benchmark_workers(args, api_key, workers)
+            )
+            for workers in args.workers
+        }
+
+    print_report(results)
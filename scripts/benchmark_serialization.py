@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Time the serialization of a large task history page: the previous path
+# (jsonable_encoder, then the standard library's JSONResponse), Pydantic
+# validating the page model, and the orjson-backed FastJSONResponse the
+# API now uses. Also times decoding the rows' JSON fields.
+#
+# Run from the repository root (no database or broker needed):
+#   python -m scripts.benchmark_serialization --rows 10000
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+import uuid
+
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from pydantic import BaseModel
+
+from web import fast_json
+from web.responses import FastJSONResponse
+
+
+# Same shape as main_api.TaskHistoryPageOut, which needs the app config.
+class TaskHistoryItemOut(BaseModel):
+    id: int
+    task_id: str
+    task_type: str
+    parameters: dict
+    status: str
+    result: Any = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+
+class TaskHistoryPageOut(BaseModel):
+    tasks: list[TaskHistoryItemOut]
+    next_cursor: str | None
+    since_cursor: str | None
+    last_updated: datetime.datetime | None
+
+
+def make_page(rows: int, seed: int) -> dict:
+    """A history page as main_api.build_task_history_page returns it."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    tasks = []
+    for i in range(rows):
+        created_at = start + datetime.timedelta(seconds=i, microseconds=i)
+        x, y = rng.randrange(10**9), rng.randrange(1, 10**9)
+        tasks.append({
+            "id": i + 1,
+            "task_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "task_type": "divide",
+            "parameters": {"x": x, "y": y},
+            "status": "SUCCESS",
+            "result": x / y,
+            "created_at": created_at,
+            "updated_at": created_at + datetime.timedelta(seconds=1),
+        })
+    return {
+        "tasks": tasks,
+        "next_cursor": None,
+        "since_cursor": None,
+        "last_updated": tasks[-1]["updated_at"] if tasks else None
+    }
+
+
+def time_median(function, repeat: int) -> float:
+    """Median seconds of `repeat` calls."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    page = make_page(args.rows, args.seed)
+
+    # The encoded JSON fields of every row, as stored in TaskHistory.
+    stored = [
+        (json.dumps(task["parameters"]), json.dumps(task["result"]))
+        for task in page["tasks"]
+    ]
+
+    encoders = {
+        "jsonable_encoder + json": lambda: JSONResponse(
+            jsonable_encoder(page)
+        ).body,
+        "pydantic model": lambda: TaskHistoryPageOut.model_validate(
+            page
+        ).model_dump_json(),
+        "orjson response": lambda: FastJSONResponse(page).body,
+    }
+    decoders = {
+        "json fields (stdlib)": lambda: [
+            (json.loads(parameters), json.loads(result))
+            for parameters, result in stored
+        ],
+        "json fields (orjson)": lambda: [
+            (fast_json.loads(parameters), fast_json.loads(result))
+            for parameters, result in stored
+        ],
+    }
+
+    # The API's responses must not change with the encoder.
+    before = json.loads(encoders["jsonable_encoder + json"]())
+    body = encoders["orjson response"]()
+    if json.loads(body) != before:
+        raise SystemExit("orjson encodes the page differently")
+
+    print(f"{args.rows} rows, {len(body)} bytes")
+    print(f"{'':>26} {'ms':>9} {'speedup':>8}")
+    for group in (encoders, decoders):
+        reference = None
+        for name, function in group.items():
+            seconds = time_median(function, args.repeat)
+            reference = reference or seconds
+            print(
+                f"{name:>26} {seconds * 1000:9.2f} "
+                f"{reference / seconds:7.1f}x"
+            )
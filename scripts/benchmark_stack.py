@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+# Load test the whole API in-process: the FastAPI app behind an ASGI
+# client, SQLite standing in for Postgres and Celery on its in-memory
+# broker. Finished tasks are written to TaskHistory by a stand-in for
+# the workers (results_in_database mode), so polling sees them change.
+#
+# Measures throughput and latency of the login callback, credit check,
+# submission, history polling and status polling, and stores them as
+# JSON to compare commits.
+#
+# Run from the repository root:
+#   python -m scripts.benchmark_stack --users 50 --requests 20 \
+#       --output bench-after.json --compare bench-before.json
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+from dataclasses import dataclass, field
+
+
+# Settings of the benchmarked app: nothing leaves the process.
+BENCH_CONFIG: str = """
+[app]
+ROOT_PATH = ""
+
+[api]
+JWT_SIGNING_SECRET_KEY = "benchmark"
+GOOGLE_CLIENT_ID = "benchmark"
+GOOGLE_CLIENT_SECRET = "benchmark"
+GOOGLE_REDIRECT_URI = "http://benchmark/auth/callback"
+
+[database]
+DB_HOST = ""
+DB_PORT = ""
+DB_NAME = ""
+DB_USERNAME = ""
+DB_PASSWORD = ""
+DB_URL = "{db_url}"
+GENERATE_SCHEMAS = true
+
+[celery]
+broker = "memory://"
+backend = "cache+memory://"
+events_url = "memory://"
+results_in_database = true
+
+[celery.fair_share]
+url = "memory://"
+"""
+
+SCENARIOS: tuple[str, ...] = (
+    "login_callback",
+    "credit_check",
+    "submission",
+    "history_polling",
+    "status_polling",
+)
+
+
+@dataclass
+class User:
+    name: str
+    token: str = ""
+    task_ids: list[str] = field(default_factory=list)
+    # `since_cursor` of the user's previous history poll.
+    since_cursor: str | None = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Cookie": f"token={self.token}"}
+
+
+class StubSSO:
+    """Stands in for Google: the callback's `user` parameter logs in."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def verify_and_process(self, request):
+        from fastapi_sso.sso.base import OpenID
+
+        name = request.query_params["user"]
+        return OpenID(
+            id=name,
+            email=f"{name}@example.com",
+            display_name=name,
+            picture="",
+            provider="google"
+        )
+
+
+def load_app(db_url: str):
+    """Import the app configured by BENCH_CONFIG."""
+    config = tempfile.NamedTemporaryFile(
+        "w", suffix=".toml", delete=False
+    )
+    with config:
+        config.write(BENCH_CONFIG.format(db_url=db_url))
+    os.environ["NANOSAAS_CONFIG"] = config.name
+
+    import main_api
+
+    stub_sso = StubSSO()
+    main_api.get_sso = lambda: stub_sso
+    return main_api
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_scenario(users: list[User], requests: int, send) -> dict:
+    """Have every user send `requests` requests one after the other."""
+    latencies: list[float] = []
+    errors = 0
+
+    async def run_user(user: User):
+        nonlocal errors
+        for i in range(requests):
+            start = time.perf_counter()
+            response = await send(user, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(user) for user in users))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+async def complete_tasks(main_api, task_ids: list[str], delay: float):
+    """Stand-in for the workers: finish the tasks after `delay` seconds."""
+    await asyncio.sleep(delay)
+    for task_id in task_ids:
+        await main_api.TaskHistory.record_state(task_id, "SUCCESS", 1.0)
+        await main_api.TaskHistory.settle_credits(task_id, refund=False)
+
+
+async def benchmark(args) -> dict:
+    import httpx
+
+    main_api = load_app(args.db_url)
+    app = main_api.app
+    rng = random.Random(args.seed)
+    users = [User(name=f"bench-{i}") for i in range(args.users)]
+    results = {}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url="http://benchmark"
+        ) as client:
+            async def login(user: User, i: int):
+                response = await client.get(
+                    "/auth/callback",
+                    params={"user": user.name}
+                )
+                user.token = response.cookies.get("token", user.token)
+                return response
+
+            async def credit_check(user: User, i: int):
+                return await client.get(
+                    "/user/credits",
+                    headers=user.headers
+                )
+
+            async def submit(user: User, i: int):
+                # Random operands, so memoization does not answer them.
+                response = await client.post(
+                    "/task/divide",
+                    json={
+                        "x": rng.randrange(10**9),
+                        "y": rng.randrange(1, 10**9)
+                    },
+                    headers=user.headers
+                )
+                if response.status_code == 200:
+                    user.task_ids.append(response.json()["id"])
+                return response
+
+            async def poll_history(user: User, i: int):
+                params = {}
+                if user.since_cursor:
+                    params["since_cursor"] = user.since_cursor
+                response = await client.get(
+                    "/user/task_history",
+                    params=params,
+                    headers=user.headers
+                )
+                if response.status_code == 200:
+                    user.since_cursor = (
+                        response.json()["since_cursor"] or user.since_cursor
+                    )
+                return response
+
+            async def poll_status(user: User, i: int):
+                task_id = "missing"
+                if user.task_ids:
+                    task_id = user.task_ids[i % len(user.task_ids)]
+                return await client.get(
+                    f"/task/status/{task_id}",
+                    headers=user.headers
+                )
+
+            results["login_callback"] = await run_scenario(
+                users, args.requests, login
+            )
+            # Enough credits for every submission.
+            await main_api.Account.all().update(credits=10**9)
+            results["credit_check"] = await run_scenario(
+                users, args.requests, credit_check
+            )
+            results["submission"] = await run_scenario(
+                users, args.requests, submit
+            )
+
+            completer = asyncio.create_task(complete_tasks(
+                main_api,
+                [task_id for user in users for task_id in user.task_ids],
+                args.task_seconds
+            ))
+            results["history_polling"] = await run_scenario(
+                users, args.requests, poll_history
+            )
+            results["status_polling"] = await run_scenario(
+                users, args.requests, poll_status
+            )
+            await completer
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    print(
+        f"{'scenario':>16} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'errors':>7}"
+    )
+    for name in SCENARIOS:
+        result = report["scenarios"][name]
+        line = (
+            f"{name:>16} {result['throughput']:10.1f} "
+            f"{result['p50_ms']:9.2f} {result['p99_ms']:9.2f} "
+            f"{result['errors']:7d}"
+        )
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            change = result["throughput"] / before["throughput"] - 1
+            line += f"   {change:+.1%} req/s vs {baseline['commit']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument(
+        "--requests", type=int, default=20,
+        help="Requests each user sends per scenario."
+    )
+    parser.add_argument(
+        "--task-seconds", type=float, default=0.5,
+        help="Delay after which the submitted tasks are finished."
+    )
+    parser.add_argument("--db-url", default="sqlite://:memory:")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON.")
+    parser.add_argument("--compare", help="Results JSON of a baseline run.")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(
+            tz=datetime.timezone.utc
+        ).isoformat(),
+        "settings": {
+            "users": args.users,
+            "requests": args.requests,
+            "task_seconds": args.task_seconds,
+            "db_url": args.db_url,
+            "seed": args.seed,
+        },
+        "scenarios": asyncio.run(benchmark(args)),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compare task throughput of one worker process when every task blocks
+# its own event loop against task threads sharing one long-lived loop,
+# on a simulated workload of I/O waits and blocking CPU work.
+#
+# Run from the repository root (no database or broker needed):
+#   python -m scripts.benchmark_worker_concurrency --tasks 200 --io 0.05
+
+import argparse
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from celery_task import WorkerLoop, run_blocking
+
+
+def burn_cpu(seconds: float) -> None:
+    """Blocking, CPU-bound part of the simulated task."""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def run_blocking_loop(tasks: int, io: float, cpu: float) -> float:
+    """Old behavior: the async task body sleeps and computes on its loop."""
+    async def task_body():
+        time.sleep(io)
+        burn_cpu(cpu)
+
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        for _ in range(tasks):
+            loop.run_until_complete(task_body())
+        return tasks / (time.perf_counter() - start)
+    finally:
+        loop.close()
+
+
+def run_shared_loop(
+    tasks: int,
+    io: float,
+    cpu: float,
+    concurrency: int
+        ) -> float:
+    """New behavior: threads pool tasks awaiting on the shared worker loop."""
+    async def task_body():
+        await asyncio.sleep(io)
+        await run_blocking(burn_cpu, cpu)
+
+    worker_loop = WorkerLoop()
+    worker_loop.start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(
+                lambda _: worker_loop.run(task_body()),
+                range(tasks)
+            ))
+        return tasks / (time.perf_counter() - start)
+    finally:
+        worker_loop.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument(
+        "--io", type=float, default=0.05,
+        help="Seconds each task waits on simulated I/O."
+    )
+    parser.add_argument(
+        "--cpu", type=float, default=0.0,
+        help="Seconds of blocking CPU work per task."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=50,
+        help="Task threads, as in `celery worker -P threads -c N`."
+    )
+    args = parser.parse_args()
+
+    before = run_blocking_loop(args.tasks, args.io, args.cpu)
+    after = run_shared_loop(args.tasks, args.io, args.cpu, args.concurrency)
+
+    print(f"Blocking loop: {before:10.1f} tasks/sec")
+    print(f"Shared loop:   {after:10.1f} tasks/sec")
+    print(f"Speedup:       {after / before:10.1f}x")
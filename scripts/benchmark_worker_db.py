@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Compare worker throughput when every task opens and closes its own DB
+# connection against a connection pool kept for the worker's lifetime.
+#
+# Run from the repository root:
+#   python -m scripts.benchmark_worker_db --tasks 500
+
+import argparse
+import asyncio
+import time
+
+from tortoise import Tortoise
+
+from shared import db_url_with_pool
+from shared import WORKER_POOL_MINSIZE, WORKER_POOL_MAXSIZE
+from web.db_models import Account
+
+
+async def init_db(db_url: str):
+    await Tortoise.init(db_url=db_url, modules={"models": ["web.db_models"]})
+    await Tortoise.generate_schemas(safe=True)
+
+
+async def task_body():
+    # The DB work of a task: one account lookup.
+    await Account.filter(id=0).exists()
+
+
+def run_init_per_task(db_url: str, tasks: int) -> float:
+    """Old behavior: a fresh event loop and connection per task."""
+    async def run_one():
+        await init_db(db_url)
+        try:
+            await task_body()
+        finally:
+            await Tortoise.close_connections()
+
+    start = time.perf_counter()
+    for _ in range(tasks):
+        asyncio.run(run_one())
+    return tasks / (time.perf_counter() - start)
+
+
+def run_persistent_pool(db_url: str, tasks: int) -> float:
+    """New behavior: one loop and pool for the whole worker lifetime."""
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(init_db(db_url))
+    try:
+        start = time.perf_counter()
+        for _ in range(tasks):
+            loop.run_until_complete(task_body())
+        return tasks / (time.perf_counter() - start)
+    finally:
+        loop.run_until_complete(Tortoise.close_connections())
+        loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument(
+        "--db-url",
+        default=db_url_with_pool(WORKER_POOL_MINSIZE, WORKER_POOL_MAXSIZE)
+    )
+    args = parser.parse_args()
+
+    before = run_init_per_task(args.db_url, args.tasks)
+    after = run_persistent_pool(args.db_url, args.tasks)
+
+    print(f"Init per task:   {before:10.1f} tasks/sec")
+    print(f"Persistent pool: {after:10.1f} tasks/sec")
+    print(f"Speedup:         {after / before:10.1f}x")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Check that the API and the worker modules import within a time budget,
+# so new processes (autoscaling, restarts, serve.py workers) start fast.
+# Each module is imported in a fresh interpreter under
+# `python -X importtime`; the slowest imports are listed, and the exit
+# status is 1 if a module is over budget, for CI. Each module is timed
+# `--repeat` times and judged on its median, imports being noisy.
+#
+# Run from the repository root, with a config.toml (or NANOSAAS_CONFIG):
+#   python -m scripts.check_import_time --top 10
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+from dataclasses import dataclass
+
+
+# Most seconds each module may take to import, with some headroom over
+# a single-core machine. FastAPI, Pydantic and Tortoise alone take about
+# 0.7 s of the API's; the workers load neither FastAPI nor Pydantic.
+BUDGETS: dict[str, float] = {
+    "main_api": 1.2,
+    "celery_task": 0.6,
+}
+
+
+@dataclass
+class ImportTime:
+    module: str
+    # Microseconds spent in the module itself, and with its imports.
+    self_us: int
+    cumulative_us: int
+
+
+def measure_imports(module: str) -> list[ImportTime]:
+    """Import times of every module loaded by `import <module>`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise SystemExit(
+            f"Importing {module} failed:\n{completed.stderr[-2000:]}"
+        )
+
+    times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if not fields[0].strip().isdigit():
+            # The header line.
+            continue
+        times.append(ImportTime(
+            module=fields[2].strip(),
+            self_us=int(fields[0]),
+            cumulative_us=int(fields[1])
+        ))
+    return times
+
+
+def top_level_packages(times: list[ImportTime]) -> dict[str, int]:
+    """Self time of the imports summed by top-level package."""
+    totals: dict[str, int] = {}
+    for entry in times:
+        package = entry.module.split(".", 1)[0]
+        totals[package] = totals.get(package, 0) + entry.self_us
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    parser.add_argument(
+        "--budget", type=float,
+        help="Most seconds each module may take to import, instead of "
+        "its entry in BUDGETS."
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in args.modules:
+        budget = args.budget or BUDGETS.get(module, 0.5)
+        runs = [measure_imports(module) for _ in range(args.repeat)]
+        totals = [
+            next(
+                entry.cumulative_us
+                for entry in times if entry.module == module
+            ) / 1e6
+            for times in runs
+        ]
+        total = statistics.median(totals)
+        # The run closest to the median, for the breakdown.
+        times = runs[totals.index(min(totals, key=lambda t: abs(t - total)))]
+        status = "ok" if total <= budget else "OVER BUDGET"
+        print(f"\n{module}: {total:.3f}s (budget {budget:.3f}s) {status}")
+
+        packages = top_level_packages(times)
+        slowest = sorted(packages, key=packages.get, reverse=True)
+        for package in slowest[:args.top]:
+            print(f"{packages[package] / 1000:10.1f} ms  {package}")
+
+        if total > budget:
+            over_budget.append(module)
+
+    if over_budget:
+        sys.exit(1)
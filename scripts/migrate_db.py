@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Add the columns that web/db_models.py gained since the first release to
+# existing tables, create the tables and indexes missing from the database,
+# once per deployment instead of on every API startup, then run the data
+# migrations below. Each step is a no-op once applied. Other changes to
+# existing tables need a migration tool such as aerich (see TORTOISE_ORM in
+# shared.py).
+#
+# Run from the repository root, before starting serve.py:
+#   python -m scripts.migrate_db
+
+import asyncio
+import hashlib
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from shared import DB_URL
+
+
+async def table_columns(connection: BaseDBAsyncClient, table: str) -> set[str]:
+    if connection.capabilities.dialect == "sqlite":
+        rows = await connection.execute_query_dict(
+            f'PRAGMA table_info("{table}")'
+        )
+        return {row["name"] for row in rows}
+
+    rows = await connection.execute_query_dict(
+        "SELECT column_name AS name FROM information_schema.columns"
+        f" WHERE table_schema = current_schema() AND table_name = '{table}'"
+    )
+    return {row["name"] for row in rows}
+
+
+# Columns added to existing tables, in order: the table, the column, its
+# definition by dialect and the statements filling it in on existing rows.
+ADDED_COLUMNS: tuple[tuple[str, str, dict[str, str], tuple[str, ...]], ...] = (
+    (
+        "account", "tier",
+        {
+            "sqlite": "VARCHAR(20) NOT NULL DEFAULT 'free'",
+            "postgres": "VARCHAR(20) NOT NULL DEFAULT 'free'",
+        },
+        ()
+    ),
+    (
+        "taskhistory", "reserved_credits",
+        {
+            "sqlite": "INT NOT NULL DEFAULT 0",
+            "postgres": "INT NOT NULL DEFAULT 0",
+        },
+        ()
+    ),
+    (
+        "taskhistory", "params_hash",
+        {"sqlite": "VARCHAR(64)", "postgres": "VARCHAR(64)"},
+        ()
+    ),
+    (
+        "taskhistory", "idempotency_key",
+        {"sqlite": "VARCHAR(255)", "postgres": "VARCHAR(255)"},
+        # Constraint of Meta.unique_together, named as generate_schemas
+        # names it.
+        (
+            'CREATE UNIQUE INDEX "uid_taskhistory_user_id_ce3eb1"'
+            ' ON "taskhistory" ("user_id", "idempotency_key");',
+        )
+    ),
+    (
+        "taskhistory", "updated_at",
+        # SQLite cannot add a NOT NULL column without a constant default.
+        {
+            "sqlite": "TIMESTAMP",
+            "postgres": "TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP",
+        },
+        ('UPDATE "taskhistory" SET "updated_at" = "created_at";',)
+    ),
+)
+
+
+async def add_missing_columns(connection: BaseDBAsyncClient) -> list[str]:
+    """
+    Add the ADDED_COLUMNS missing from existing tables, before
+    generate_schemas creates the indexes using them.
+
+    Returns the columns added, as "table.column".
+    """
+    dialect = connection.capabilities.dialect
+    added = []
+    columns_by_table: dict[str, set[str]] = {}
+    for table, column, definitions, backfill in ADDED_COLUMNS:
+        if table not in columns_by_table:
+            columns_by_table[table] = await table_columns(connection, table)
+        columns = columns_by_table[table]
+        # Missing tables are created whole by generate_schemas.
+        if not columns or column in columns:
+            continue
+
+        await connection.execute_script(
+            f'ALTER TABLE "{table}" ADD COLUMN "{column}"'
+            f" {definitions[dialect]};"
+        )
+        for statement in backfill:
+            await connection.execute_script(statement)
+        columns.add(column)
+        added.append(f"{table}.{column}")
+    return added
+
+
+async def hash_plaintext_api_keys(connection: BaseDBAsyncClient) -> int:
+    """
+    Replace the plaintext Account.api_key column by the api_key_hash and
+    api_key_prefix columns, keeping the existing keys valid.
+
+    Returns the number of keys carried over.
+    """
+    columns = await table_columns(connection, "account")
+    if "api_key" not in columns:
+        return 0
+
+    if "api_key_hash" not in columns:
+        await connection.execute_script(
+            'ALTER TABLE "account" ADD COLUMN "api_key_hash" VARCHAR(64);'
+            ' CREATE UNIQUE INDEX "uid_account_api_key_hash"'
+            ' ON "account" ("api_key_hash");'
+        )
+    if "api_key_prefix" not in columns:
+        await connection.execute_script(
+            'ALTER TABLE "account" ADD COLUMN "api_key_prefix" VARCHAR(12);'
+        )
+
+    rows = await connection.execute_query_dict(
+        'SELECT "id", "api_key" FROM "account"'
+        ' WHERE "api_key" IS NOT NULL AND "api_key" <> \'\''
+    )
+    if rows:
+        # Same hash and prefix as main_api.hash_api_key and
+        # API_KEY_PREFIX_LENGTH.
+        placeholders = ("?", "?", "?")
+        if connection.capabilities.dialect != "sqlite":
+            placeholders = ("$1", "$2", "$3")
+        await connection.execute_many(
+            'UPDATE "account" SET "api_key_hash" = {}, "api_key_prefix" = {}'
+            ' WHERE "id" = {}'.format(*placeholders),
+            [
+                [
+                    hashlib.sha256(row["api_key"].encode()).hexdigest(),
+                    row["api_key"][:8],
+                    row["id"]
+                ]
+                for row in rows
+            ]
+        )
+
+    await connection.execute_script(
+        'ALTER TABLE "account" DROP COLUMN "api_key";'
+    )
+    return len(rows)
+
+
+async def migrate() -> None:
+    await Tortoise.init(db_url=DB_URL, modules={"models": ["web.db_models"]})
+    try:
+        async with in_transaction() as connection:
+            added = await add_missing_columns(connection)
+        if added:
+            print(f"Added columns {', '.join(added)}.")
+        await Tortoise.generate_schemas(safe=True)
+        async with in_transaction() as connection:
+            hashed = await hash_plaintext_api_keys(connection)
+        if hashed:
+            print(f"Hashed {hashed} plaintext API keys.")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
+    print("Database schema is up to date.")
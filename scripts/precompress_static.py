@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Write the gzip (and, with the brotli package, brotli) variants of the
+# compressible files under web/static, which the API serves in place of
+# the originals to clients accepting them. Run after changing an asset;
+# variants already newer than their file are kept.
+#
+# Run from the repository root:
+#   python -m scripts.precompress_static
+
+import argparse
+
+from pathlib import Path
+
+from web.pages import ENCODING_SUFFIXES
+from web.pages import available_encodings, compress
+
+
+STATIC_DIR: Path = Path("web/static")
+
+COMPRESSIBLE_SUFFIXES: frozenset[str] = frozenset(
+    {".css", ".html", ".js", ".json", ".map", ".svg", ".txt", ".xml"}
+)
+
+
+def precompress(path: Path, force: bool) -> list[str]:
+    """Write the variants of one file, and return the ones written."""
+    body = path.read_bytes()
+    written = []
+    for encoding in available_encodings():
+        target = path.with_name(path.name + ENCODING_SUFFIXES[encoding])
+        if (
+            not force
+            and target.exists()
+            and target.stat().st_mtime >= path.stat().st_mtime
+        ):
+            continue
+        compressed = compress(body, encoding)
+        if len(compressed) >= len(body):
+            # Not worth it: serve the original.
+            target.unlink(missing_ok=True)
+            continue
+        target.write_bytes(compressed)
+        written.append(f"{target} ({len(body)} -> {len(compressed)} bytes)")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", type=Path, default=STATIC_DIR)
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Rewrite the variants even if they are up to date."
+    )
+    args = parser.parse_args()
+
+    for path in sorted(args.directory.rglob("*")):
+        if path.is_file() and path.suffix in COMPRESSIBLE_SUFFIXES:
+            for line in precompress(path, args.force):
+                print(line)
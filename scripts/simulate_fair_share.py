@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Simulate a shared worker pool fed by many synthetic users, one or more
+# of which flood it with a burst of tasks, and report the p50/p99 queue
+# wait of every user with a single FIFO queue and with the fair share
+# priorities of scheduling.py.
+#
+# Run from the repository root (no database or broker needed):
+#   python -m scripts.simulate_fair_share --light-users 20 --burst 5000
+
+import argparse
+import asyncio
+import heapq
+import math
+import random
+
+from scheduling import InMemoryTokenBucket
+from scheduling import FAIR_SHARE_RATE, FAIR_SHARE_BURST
+from scheduling import task_priorities
+
+
+def make_workload(
+    light_users: int,
+    heavy_users: int,
+    burst: int,
+    light_rate: float,
+    duration: float,
+    seed: int
+        ) -> list[tuple[float, str]]:
+    """
+    Submissions as (time, user), sorted by time.
+
+    Light users submit at random with `light_rate` tasks per second each,
+    heavy users submit `burst` tasks at once when the simulation starts.
+    """
+    rng = random.Random(seed)
+    submissions = []
+    for user in range(light_users):
+        t = rng.expovariate(light_rate)
+        while t < duration:
+            submissions.append((t, f"light-{user}"))
+            t += rng.expovariate(light_rate)
+    for user in range(heavy_users):
+        submissions.extend((0.0, f"heavy-{user}") for _ in range(burst))
+    submissions.sort(key=lambda submission: submission[0])
+    return submissions
+
+
+async def simulate(
+    submissions: list[tuple[float, str]],
+    workers: int,
+    task_seconds: float,
+    fair: bool,
+    rate: float,
+    burst: int
+        ) -> dict[str, list[float]]:
+    """Queue wait of every task of each user, in seconds."""
+    clock = 0.0
+    buckets = InMemoryTokenBucket(rate, burst, clock=lambda: clock)
+    # Times at which each worker becomes free.
+    free_at = [0.0] * workers
+    # (priority, submission order, submitted at, user)
+    queue: list[tuple[int, int, float, str]] = []
+    waits: dict[str, list[float]] = {}
+
+    i = 0
+    while i < len(submissions) or queue:
+        next_submission = (
+            submissions[i][0] if i < len(submissions) else math.inf
+        )
+        if queue and free_at[0] <= next_submission:
+            # The first free worker takes the most urgent task.
+            clock = max(clock, heapq.heappop(free_at))
+            _, _, submitted_at, user = heapq.heappop(queue)
+            waits.setdefault(user, []).append(clock - submitted_at)
+            heapq.heappush(free_at, clock + task_seconds)
+            continue
+
+        clock, user = submissions[i]
+        priority = 0
+        if fair:
+            [priority] = await task_priorities(buckets, user, "free", 1)
+        heapq.heappush(queue, (priority, i, clock, user))
+        i += 1
+
+    return waits
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(title: str, waits: dict[str, list[float]]) -> None:
+    print(f"\n{title}")
+    print(f"{'user':>10} {'tasks':>7} {'p50 wait':>10} {'p99 wait':>10}")
+    for user in sorted(waits, key=lambda user: (user[0], len(user), user)):
+        print(
+            f"{user:>10} {len(waits[user]):7d} "
+            f"{percentile(waits[user], 0.50):9.2f}s "
+            f"{percentile(waits[user], 0.99):9.2f}s"
+        )
+
+    light = [
+        wait for user, user_waits in waits.items()
+        if user.startswith("light") for wait in user_waits
+    ]
+    if light:
+        print(
+            f"{'all light':>10} {len(light):7d} "
+            f"{percentile(light, 0.50):9.2f}s "
+            f"{percentile(light, 0.99):9.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--light-users", type=int, default=20)
+    parser.add_argument("--heavy-users", type=int, default=1)
+    parser.add_argument(
+        "--burst", type=int, default=5000,
+        help="Tasks each heavy user submits at once."
+    )
+    parser.add_argument(
+        "--light-rate", type=float, default=0.2,
+        help="Tasks per second submitted by each light user."
+    )
+    parser.add_argument("--duration", type=float, default=120.0)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--task-seconds", type=float, default=0.5)
+    parser.add_argument("--rate", type=float, default=FAIR_SHARE_RATE)
+    parser.add_argument("--bucket", type=int, default=FAIR_SHARE_BURST)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    submissions = make_workload(
+        args.light_users,
+        args.heavy_users,
+        args.burst,
+        args.light_rate,
+        args.duration,
+        args.seed
+    )
+    for title, fair in (("Single FIFO queue", False), ("Fair share", True)):
+        waits = asyncio.run(simulate(
+            submissions,
+            args.workers,
+            args.task_seconds,
+            fair,
+            args.rate,
+            args.bucket
+        ))
+        report(title, waits)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Fire thousands of concurrent credit reservations and refunds at one
+# account and check that the balance is never overdrawn nor lost.
+#
+# Run from the repository root against a local database:
+#   python -m scripts.stress_credits --submissions 5000 --credits 1000
+
+import argparse
+import asyncio
+import sys
+import uuid
+
+from tortoise import Tortoise
+
+from shared import db_url_with_pool
+from web.db_models import Account, TaskHistory
+
+
+async def submit(account_id: int) -> str | None:
+    """Reserve a credit and record the task, like the submit endpoints."""
+    if not await Account.reserve_credits(account_id):
+        return None
+
+    task_id = str(uuid.uuid4())
+    await TaskHistory.create(
+        user_id=account_id,
+        task_id=task_id,
+        task_type="stress",
+        parameters={},
+        reserved_credits=1
+    )
+    return task_id
+
+
+async def stress(db_url: str, submissions: int, credits: int) -> bool:
+    await Tortoise.init(db_url=db_url, modules={"models": ["web.db_models"]})
+    await Tortoise.generate_schemas(safe=True)
+    try:
+        marker = uuid.uuid4().hex
+        account = await Account.create(
+            google_id=f"stress-{marker}",
+            email=f"stress-{marker}@example.com",
+            picture="",
+            provider="stress",
+            credits=credits
+        )
+
+        task_ids = await asyncio.gather(
+            *(submit(account.id) for _ in range(submissions))
+        )
+        accepted = [task_id for task_id in task_ids if task_id is not None]
+        await account.refresh_from_db()
+        print(f"Accepted {len(accepted)} of {submissions} submissions, "
+              f"{account.credits} credits left")
+        ok = len(accepted) == min(credits, submissions)
+        ok = ok and account.credits == credits - len(accepted)
+
+        # Settle every task twice, concurrently: half refunded, half
+        # committed. Each reservation must be settled exactly once.
+        refunded = set(accepted[::2])
+        await asyncio.gather(
+            *(
+                TaskHistory.settle_credits(task_id, refund=task_id in refunded)
+                for task_id in accepted + accepted
+            )
+        )
+        await account.refresh_from_db()
+        expected = credits - len(accepted) + len(refunded)
+        print(f"After settlement: {account.credits} credits, "
+              f"expected {expected}")
+        ok = ok and account.credits == expected
+
+        await TaskHistory.filter(user_id=account.id).delete()
+        await account.delete()
+        return ok
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--submissions", type=int, default=2000)
+    parser.add_argument("--credits", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=50)
+    parser.add_argument("--db-url", default=None)
+    args = parser.parse_args()
+
+    db_url = args.db_url or db_url_with_pool(args.pool_size, args.pool_size)
+    ok = asyncio.run(stress(db_url, args.submissions, args.credits))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
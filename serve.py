@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Production launcher of the API. The app is imported once, then the
+# worker processes are forked from it, sharing its memory copy on write,
+# and serve one listening socket. Each worker opens its own database
+# pool ([database] API_POOL_*) when it starts.
+#
+# SIGTERM or SIGINT drains the workers: they stop accepting connections
+# and finish their requests, for at most `graceful_timeout` seconds,
+# before closing their pools. Workers that die are restarted.
+#
+# Create the tables once, then start it from the repository root:
+#   python -m scripts.migrate_db
+#   python serve.py --workers 4
+#
+# With more than one worker, point PROMETHEUS_MULTIPROC_DIR to an empty
+# directory so /metrics reports every process.
+
+import argparse
+import os
+import signal
+import socket
+import time
+import traceback
+
+import uvicorn
+
+from shared import CONFIG
+
+import metrics
+
+
+SERVER_CONFIG: dict = CONFIG.get("server", {})
+
+HOST: str = SERVER_CONFIG.get("host", "127.0.0.1")
+PORT: int = SERVER_CONFIG.get("port", 51337)
+WORKERS: int = SERVER_CONFIG.get("workers", os.cpu_count() or 1)
+GRACEFUL_TIMEOUT: float = SERVER_CONFIG.get("graceful_timeout", 30.0)
+BACKLOG: int = SERVER_CONFIG.get("backlog", 2048)
+
+# Workers dying sooner than this after their start failed to start,
+# most likely for good (configuration, database down): stop instead of
+# restarting them in a loop.
+MIN_WORKER_UPTIME: float = 5.0
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, graceful_timeout: float) -> None:
+    """Serve `app` on `sock` until signalled, in a forked process."""
+    # Terminal signals go to the launcher only, which relays one SIGTERM:
+    # a second signal would make uvicorn skip the drain.
+    os.setpgid(0, 0)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+
+    from main_api import UVICORN_LOG_CONFIG
+
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_config=UVICORN_LOG_CONFIG,
+        timeout_graceful_shutdown=graceful_timeout
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(
+    app,
+    host: str = HOST,
+    port: int = PORT,
+    workers: int = WORKERS,
+    graceful_timeout: float = GRACEFUL_TIMEOUT
+        ) -> None:
+    """Fork `workers` processes serving `app`, until SIGTERM or SIGINT."""
+    sock = bind_socket(host, port, BACKLOG)
+    # Worker pid -> monotonic time it was started.
+    children: dict[int, float] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app, sock, graceful_timeout)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print(f"Draining {len(children)} workers...")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on {host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started_at = children.pop(pid)
+        metrics.mark_process_dead(pid)
+        if stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started_at < MIN_WORKER_UPTIME:
+            print(f"Worker {pid} exited with {code} while starting")
+            stop(signal.SIGTERM, None)
+        else:
+            print(f"Worker {pid} exited with {code}, restarting it")
+            spawn()
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT,
+        help="Seconds workers get to finish their requests on shutdown."
+    )
+    args = parser.parse_args()
+
+    # Imported before forking, once for every worker, along with Celery,
+    # which the app only loads when it first publishes a task.
+    from main_api import app
+    from task_registry import load_tasks
+
+    load_tasks()
+
+    serve(app, args.host, args.port, args.workers, args.graceful_timeout)
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+import functools
+import os
+import urllib.parse
+
 from pathlib import Path
 
 import tomllib
@@ -8,8 +12,18 @@ import tomllib
 ##################
 # --- CONFIG --- #
 ##################
-with Path("config.toml").open(mode="rb") as fp:
-    CONFIG = tomllib.load(fp)
+# NANOSAAS_CONFIG points to another file, e.g. for benchmarks.
+CONFIG_PATH = Path(os.environ.get("NANOSAAS_CONFIG", "config.toml"))
+
+
+@functools.cache
+def load_config(path: Path = CONFIG_PATH) -> dict:
+    """Parse a config file, once per process."""
+    with path.open(mode="rb") as fp:
+        return tomllib.load(fp)
+
+
+CONFIG: dict = load_config()
 
 
 DB_USERNAME: str = CONFIG["database"]["DB_USERNAME"]
@@ -18,9 +32,40 @@ DB_HOST: str = CONFIG["database"]["DB_HOST"]
 DB_PORT: str = CONFIG["database"]["DB_PORT"]
 DB_NAME: str = CONFIG["database"]["DB_NAME"]
 
-DB_URL: str =\
+# A full DB_URL in [database] replaces the Postgres settings above.
+DB_URL: str = CONFIG["database"].get("DB_URL") or\
     f"postgres://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Connections kept open by each Celery worker process.
+WORKER_POOL_MINSIZE: int = CONFIG["database"].get("WORKER_POOL_MINSIZE", 1)
+WORKER_POOL_MAXSIZE: int = CONFIG["database"].get("WORKER_POOL_MAXSIZE", 2)
+
+
+# Connections kept open by each API process, the client's defaults if
+# unset. Size them so workers * API_POOL_MAXSIZE fits the database.
+API_POOL_MINSIZE: int = CONFIG["database"].get("API_POOL_MINSIZE", 1)
+API_POOL_MAXSIZE: int | None = CONFIG["database"].get("API_POOL_MAXSIZE")
+
+# Create missing tables when the API starts. Off by default: production
+# databases are created once with `python -m scripts.migrate_db`.
+GENERATE_SCHEMAS: bool = CONFIG["database"].get("GENERATE_SCHEMAS", False)
+
+
+def db_url_with_pool(minsize: int, maxsize: int) -> str:
+    """
+    DB_URL with the connection pool bounds of the asyncpg client, merged
+    into the query parameters it may already have.
+    """
+    base, _, query = DB_URL.partition("?")
+    params = dict(urllib.parse.parse_qsl(query, keep_blank_values=True))
+    params.update(minsize=minsize, maxsize=maxsize)
+    return f"{base}?{urllib.parse.urlencode(params)}"
+
+
+API_DB_URL: str = DB_URL
+if API_POOL_MAXSIZE is not None:
+    API_DB_URL = db_url_with_pool(API_POOL_MINSIZE, API_POOL_MAXSIZE)
+
 TORTOISE_ORM = {
     "connections": {
         "default": DB_URL,
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextlib
+import json
+
+from collections import defaultdict
+
+from shared import CONFIG
+
+
+# Pub/sub channel carrying task status transitions from the workers.
+TASK_EVENTS_CHANNEL: str = "nanosaas:task_events"
+
+# Seconds between reconnection attempts of the hub listener.
+RECONNECT_DELAY: float = 1.0
+
+# Events buffered per subscriber before the oldest ones are dropped.
+SUBSCRIBER_QUEUE_SIZE: int = 100
+
+
+#############################
+#                           #
+#      --- BROKERS ---      #
+#                           #
+#############################
+class RedisBroker:
+    """
+    Redis pub/sub broker.
+
+    Workers publish synchronously, API processes listen asynchronously.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+
+    def publish(self, channel: str, message: str) -> None:
+        if self._client is None:
+            # pip install redis
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(channel, message)
+
+    async def listen(self, channel: str):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.unsubscribe(channel)
+            await client.aclose()
+
+
+class InMemoryBroker:
+    """
+    Process-local stand-in for `RedisBroker`.
+
+    Used by tests and by Celery eager mode, where the publisher and the
+    listener share a process. `publish` is thread safe.
+    """
+
+    def __init__(self):
+        # (channel, loop of the listener, queue) per active listener.
+        self._listeners: list[tuple] = []
+
+    def publish(self, channel: str, message: str) -> None:
+        for listener_channel, loop, queue in list(self._listeners):
+            if listener_channel != channel or loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def listen(self, channel: str):
+        listener = (channel, asyncio.get_running_loop(), asyncio.Queue())
+        self._listeners.append(listener)
+        try:
+            while True:
+                yield await listener[2].get()
+        finally:
+            self._listeners.remove(listener)
+
+
+def get_broker(url: str) -> RedisBroker | InMemoryBroker:
+    """Return the broker matching the scheme of `url`."""
+    if url.startswith("memory://"):
+        return InMemoryBroker()
+    return RedisBroker(url)
+
+
+def publish_task_event(
+    task_id: str,
+    account_id: int | None,
+    status: str,
+    result=None
+        ) -> None:
+    """Publish a task status transition to every API process."""
+    event = {
+        "task_id": task_id,
+        "account_id": account_id,
+        "status": status,
+        "result": result,
+    }
+    broker.publish(TASK_EVENTS_CHANNEL, json.dumps(event, default=str))
+
+
+#########################
+#                       #
+#      --- HUB ---      #
+#                       #
+#########################
+class TaskEventHub:
+    """
+    Fan out task events to the clients of one API process.
+
+    A single broker subscription feeds every local subscriber, each of
+    which listens on a key: `task:<task_id>` or `account:<account_id>`.
+    """
+
+    def __init__(self, broker, channel: str = TASK_EVENTS_CHANNEL):
+        self.broker = broker
+        self.channel = channel
+        self._queues: defaultdict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._listener: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for message in self.broker.listen(self.channel):
+                    self.dispatch(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Task event listener error: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def dispatch(self, event: dict) -> None:
+        keys = (
+            f"task:{event['task_id']}",
+            f"account:{event.get('account_id')}",
+        )
+        for key in keys:
+            for queue in self._queues.get(key, ()):
+                if queue.full():
+                    # Slow consumer: drop its oldest event, keep the newest.
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    @contextlib.contextmanager
+    def subscribe(self, key: str):
+        """Register a queue receiving every event published under `key`."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._queues[key].add(queue)
+        try:
+            yield queue
+        finally:
+            self._queues[key].discard(queue)
+            if not self._queues[key]:
+                del self._queues[key]
+
+
+broker = get_broker(
+    CONFIG["celery"].get("events_url", CONFIG["celery"]["broker"])
+)
+hub = TaskEventHub(broker)
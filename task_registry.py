@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import functools
+import hashlib
+import importlib
+import json
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from shared import CONFIG
+
+if TYPE_CHECKING:
+    from celery import Task
+
+
+###########################
+#                         #
+#      --- TYPES ---      #
+#                         #
+###########################
+@dataclass(frozen=True)
+class TaskType:
+    """
+    A kind of task users can submit.
+
+    The API generates the submission endpoints of every registered type
+    from these declarations.
+    """
+
+    # URL segment and `TaskHistory.task_type` of the tasks.
+    name: str
+    # Import path ("module.name") of the Celery task, called with the
+    # parameters and `account_id` as keywords. Imported on first use, so
+    # the API starts without loading Celery.
+    task_path: str
+    # Pydantic model validating the parameters of one task.
+    params: type[BaseModel]
+    # Credits reserved at submission.
+    credit_cost: int = 1
+    # Celery queue, None for the default one.
+    queue: str | None = None
+    # Celery priority, None to use the priority of the account's tier.
+    priority: int | None = None
+    # Answer submissions identical to an earlier successful task, younger
+    # than `memo_ttl` seconds, with its result instead of running it
+    # again. Only for deterministic tasks.
+    memoize: bool = False
+    memo_ttl: float = 3600.0
+    # Credits charged for a submission answered from a memoized result.
+    memo_credit_cost: int = 0
+
+    @functools.cached_property
+    def task(self) -> "Task":
+        module, name = self.task_path.rsplit(".", 1)
+        return getattr(importlib.import_module(module), name)
+
+    def publish_options(self) -> dict:
+        """Routing options to pass to `apply_async` or `signature`."""
+        if self.queue is None:
+            return {}
+        return {"queue": self.queue}
+
+    def params_hash(self, params: BaseModel) -> str:
+        """Key of the task type and canonical parameters, for memoization."""
+        canonical = json.dumps(
+            [self.name, params.model_dump(mode="json")],
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+TASK_TYPES: dict[str, TaskType] = {}
+
+# Per task type overrides of `queue` and `priority`, from config.toml.
+TASK_ROUTES: dict[str, dict] = CONFIG["celery"].get("routes", {})
+
+
+def register_task_type(task_type: TaskType) -> TaskType:
+    """Register a task type, applying its routing from config.toml."""
+    route = TASK_ROUTES.get(task_type.name, {})
+    task_type = dataclasses.replace(task_type, **{
+        option: route[option]
+        for option in ("queue", "priority")
+        if option in route
+    })
+
+    if task_type.name in TASK_TYPES:
+        raise ValueError(f"Task type {task_type.name!r} already registered")
+    TASK_TYPES[task_type.name] = task_type
+    return task_type
+
+
+def load_tasks() -> None:
+    """Import the Celery task of every type now instead of on first use."""
+    for task_type in TASK_TYPES.values():
+        task_type.task
+
+
+##############################
+#                            #
+#      --- REGISTRY ---      #
+#                            #
+##############################
+# Parameters of one division task.
+class DivideIn(BaseModel):
+    x: int
+    y: int
+
+
+DIVIDE = register_task_type(TaskType(
+    name="divide",
+    task_path="celery_task.divide",
+    params=DivideIn,
+    credit_cost=1,
+    memoize=True
+))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Configuration shared by the tests: SQLite in memory, Celery on its
+# in-memory broker, no divide delay and query_budget = "strict". Written
+# before the test modules import shared.py, which reads it.
+
+import os
+import tempfile
+
+
+TEST_CONFIG: str = """
+[app]
+ROOT_PATH = ""
+
+[api]
+JWT_SIGNING_SECRET_KEY = "test"
+GOOGLE_CLIENT_ID = "test"
+GOOGLE_CLIENT_SECRET = "test"
+GOOGLE_REDIRECT_URI = "http://test/auth/callback"
+
+[api.rate_limit]
+enabled = false
+
+[database]
+DB_HOST = ""
+DB_PORT = ""
+DB_NAME = ""
+DB_USERNAME = ""
+DB_PASSWORD = ""
+DB_URL = "sqlite://:memory:"
+GENERATE_SCHEMAS = true
+
+[celery]
+broker = "memory://"
+backend = "cache+memory://"
+events_url = "memory://"
+results_in_database = true
+divide_delay = 0
+
+[celery.fair_share]
+url = "memory://"
+
+[debug]
+query_budget = "strict"
+n_plus_one_threshold = 3
+"""
+
+with tempfile.NamedTemporaryFile("w", suffix=".toml", delete=False) as config:
+    config.write(TEST_CONFIG)
+os.environ["NANOSAAS_CONFIG"] = config.name
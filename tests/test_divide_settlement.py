@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# The divide task settles the credit reserved at submission: committed
+# when it succeeds, refunded when it fails. It runs eagerly, on the
+# worker's event loop as in a worker process, against SQLite in memory.
+#
+# Run from the repository root:
+#   python -m pytest tests
+
+import uuid
+
+import pytest
+
+# tests/conftest.py has written the configuration.
+from tortoise import Tortoise
+
+from celery_task import divide, run_on_worker_loop, worker_loop
+from web.db_models import Account, TaskHistory
+
+
+@pytest.fixture(scope="module")
+def account_id():
+    run_on_worker_loop(Tortoise.generate_schemas())
+    account = run_on_worker_loop(Account.create(
+        google_id="settlement",
+        email="settlement@example.com",
+        picture="",
+        provider="google",
+        credits=10
+    ))
+    yield account.id
+    worker_loop.stop()
+
+
+def submit_divide(account_id: int, x, y) -> str:
+    """Reserve a credit and record the task, as main_api does."""
+    task_id = str(uuid.uuid4())
+
+    async def reserve():
+        assert await Account.reserve_credits(account_id)
+        await TaskHistory.create(
+            user_id=account_id,
+            task_id=task_id,
+            task_type="divide",
+            parameters={"x": x, "y": y},
+            reserved_credits=1
+        )
+
+    run_on_worker_loop(reserve())
+    return task_id
+
+
+def settlement(account_id: int, task_id: str) -> tuple[int, int]:
+    """Credits left on the account, credits still reserved by the task."""
+    async def read():
+        account = await Account.get(id=account_id)
+        task = await TaskHistory.get(task_id=task_id)
+        return account.credits, task.reserved_credits
+
+    return run_on_worker_loop(read())
+
+
+def test_success_commits_the_credit(account_id):
+    task_id = submit_divide(account_id, 1, 2)
+    credits, reserved = settlement(account_id, task_id)
+    assert reserved == 1
+
+    result = divide.apply(
+        kwargs={"x": 1, "y": 2, "account_id": account_id},
+        task_id=task_id
+    )
+
+    assert result.state == "SUCCESS"
+
+    assert settlement(account_id, task_id) == (credits, 0)
+
+
+def test_failure_refunds_the_credit(account_id):
+    task_id = submit_divide(account_id, 1, 0)
+    credits, reserved = settlement(account_id, task_id)
+    assert reserved == 1
+
+    result = divide.apply(
+        kwargs={"x": 1, "y": 0, "account_id": account_id},
+        task_id=task_id
+    )
+
+    # Not SUCCESS, which would make the error a memoized result.
+    assert result.state == "FAILURE"
+
+    assert settlement(account_id, task_id) == (credits + 1, 0)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# Every route of the API against its ORM query budget (QUERY_BUDGETS in
+# main_api.py). The app runs in-process, as in scripts/benchmark_stack.py:
+# an ASGI client, SQLite in memory, Celery on its in-memory broker, and
+# query_budget = "strict", so a route over its budget answers 500.
+#
+# Run from the repository root:
+#   python -m pytest tests
+
+import asyncio
+import uuid
+
+import pytest
+
+# tests/conftest.py has written the configuration.
+import main_api
+
+from fastapi.routing import APIRoute
+
+
+class StubSSO:
+    """Stands in for Google: the callback's `user` parameter logs in."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def get_login_redirect(self):
+        from fastapi.responses import RedirectResponse
+
+        return RedirectResponse("http://test/auth/callback?user=redirected")
+
+    async def verify_and_process(self, request):
+        from fastapi_sso.sso.base import OpenID
+
+        name = request.query_params["user"]
+        return OpenID(
+            id=name,
+            email=f"{name}@example.com",
+            display_name=name,
+            picture="",
+            provider="google"
+        )
+
+
+async def stream_and_disconnect(app, path: str, headers: dict) -> int:
+    """
+    Status of a streaming GET, the client hanging up right after the
+    response started: the ASGI client would wait for the stream to end.
+    """
+    status = None
+    request_sent = False
+    started = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await started.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            started.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("test", 80),
+        "client": ("127.0.0.1", 1234),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in headers.items()
+        ],
+    }
+    await asyncio.wait_for(app(scope, receive, send), timeout=10)
+    return status
+
+
+async def exercise_routes() -> dict[tuple[str, str], int]:
+    """Call every budgeted route once, and return each one's status."""
+    import httpx
+
+    app = main_api.app
+    statuses: dict[tuple[str, str], int] = {}
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url="http://test"
+        ) as client:
+            async def call(method: str, route: str, path: str, **kwargs):
+                response = await client.request(method, path, **kwargs)
+                # Routes called more than once keep their worst status.
+                statuses[method, route] = max(
+                    statuses.get((method, route), 0),
+                    response.status_code
+                )
+                return response
+
+            await call("GET", "/", "/")
+            await call("GET", "/thankyou", "/thankyou")
+            await call("GET", "/auth/login", "/auth/login")
+            login = await call(
+                "GET", "/auth/callback", "/auth/callback",
+                params={"user": "budget"}
+            )
+            # Sent explicitly from here on, so logging out keeps it.
+            session = {"Cookie": f"token={login.cookies['token']}"}
+            client.cookies.clear()
+
+            created = await call(
+                "POST", "/user/api_key", "/user/api_key", headers=session
+            )
+            key = {"api_key": created.json()["api_key"]}
+            await call(
+                "GET", "/user/api_key", "/user/api_key", headers=session
+            )
+            await call(
+                "GET", "/user/api_key_page", "/user/api_key_page",
+                headers=session
+            )
+            await call("GET", "/userpanel", "/userpanel", headers=session)
+            await call(
+                "GET", "/user/credits", "/user/credits", headers=session
+            )
+            await call(
+                "GET", "/api/user_credits", "/api/user_credits", params=key
+            )
+
+            submitted = await call(
+                "POST", "/task/divide", "/task/divide",
+                json={"x": 1, "y": 2}, headers=session
+            )
+            task_id = submitted.json()["id"]
+            await call(
+                "POST", "/api/task/divide", "/api/task/divide",
+                json={"x": 3, "y": 4}, params=key
+            )
+            tasks = {"tasks": [{"x": i, "y": 7} for i in range(5)]}
+            await call(
+                "POST", "/task/divide/batch", "/task/divide/batch",
+                json=tasks, headers=session
+            )
+            await call(
+                "POST", "/api/task/divide/batch", "/api/task/divide/batch",
+                json=tasks, params=key
+            )
+            await call(
+                "GET", "/task/divide/{x}/{y}", "/task/divide/5/6",
+                headers=session
+            )
+            await call(
+                "GET", "/api/task/divide/{x}/{y}", "/api/task/divide/7/8",
+                params=key
+            )
+
+            page = await call(
+                "GET", "/user/task_history", "/user/task_history",
+                headers=session
+            )
+            await call(
+                "GET", "/user/task_history", "/user/task_history",
+                params={"since_cursor": page.json()["since_cursor"]},
+                headers=session
+            )
+
+            # Unknown tasks are looked up in the archive too.
+            for task in (task_id, str(uuid.uuid4())):
+                await call(
+                    "GET", "/task/status/{task_id}", f"/task/status/{task}",
+                    headers=session
+                )
+                await call(
+                    "GET", "/api/task/status/{task_id}",
+                    f"/api/task/status/{task}",
+                    params=key
+                )
+            await call(
+                "GET", "/task_details/{task_id}", f"/task_details/{task_id}",
+                headers=session
+            )
+            await call(
+                "GET", "/api/task_details_from_user/{task_id}",
+                f"/api/task_details_from_user/{task_id}",
+                params={"wait": 0}, headers=session
+            )
+            await call(
+                "GET", "/api/task_details/{task_id}",
+                f"/api/task_details/{task_id}",
+                params={**key, "wait": 0}
+            )
+
+            # A long poll seeing the task start, which is not written to
+            # its row unless results live in the database, then finish.
+            async def publish_events():
+                for status in ("STARTED", "SUCCESS"):
+                    await asyncio.sleep(0.6)
+                    main_api.task_event_hub.dispatch(
+                        {"task_id": task_id, "status": status}
+                    )
+
+            publisher = asyncio.create_task(publish_events())
+            await call(
+                "GET", "/api/task_details/{task_id}",
+                f"/api/task_details/{task_id}",
+                params={**key, "wait": 5}
+            )
+            await publisher
+
+            # Unknown tasks are looked up in the archive too.
+            statuses["GET", "/task/events/{task_id}"] = max([
+                await stream_and_disconnect(
+                    app, f"/task/events/{task}", session
+                )
+                for task in (task_id, str(uuid.uuid4()))
+            ])
+            statuses["GET", "/user/task_events"] = (
+                await stream_and_disconnect(
+                    app, "/user/task_events", session
+                )
+            )
+
+            await call("GET", "/metrics", "/metrics")
+            await call("GET", "/auth/logout", "/auth/logout")
+
+    return statuses
+
+
+@pytest.fixture(scope="module")
+def route_queries() -> dict[tuple[str, str], tuple[int, int]]:
+    """Most queries and the status, by route, of calling every route."""
+    queries: dict[tuple[str, str], int] = {}
+    check_query_budget = main_api.check_query_budget
+
+    def record_queries(method, route, stats):
+        queries[method, route] = max(
+            queries.get((method, route), 0),
+            stats.count
+        )
+        return check_query_budget(method, route, stats)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main_api, "get_sso", lambda: StubSSO())
+        patch.setattr(main_api, "check_query_budget", record_queries)
+        statuses = asyncio.run(exercise_routes())
+
+    return {
+        route: (statuses[route], queries.get(route, 0))
+        for route in statuses
+    }
+
+
+def test_every_route_has_a_budget():
+    routes = {
+        (method, route.path)
+        for route in main_api.app.routes
+        if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+    assert routes - main_api.QUERY_BUDGETS.keys() == set()
+
+
+@pytest.mark.parametrize(
+    "route",
+    sorted(main_api.QUERY_BUDGETS),
+    ids=" ".join
+)
+def test_route_within_query_budget(route, route_queries):
+    assert route in route_queries, f"{route} was not called"
+    status, count = route_queries[route]
+    assert status != 500
+    assert count <= main_api.QUERY_BUDGETS[route]
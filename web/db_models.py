@@ -1,7 +1,21 @@
 #!/usr/bin/env python3
 
+import datetime
+import zlib
+
 from tortoise.models import Model
 from tortoise import fields
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from tortoise import timezone
+
+from web import fast_json
+
+
+# Celery states after which a task never changes again.
+READY_STATES: frozenset[str] = frozenset(
+    {"SUCCESS", "FAILURE", "REVOKED"}
+)
 
 
 # Define Account Model using TortoiseORM
@@ -16,11 +30,34 @@ class Account(Model):
     provider = fields.CharField(max_length=50)
     created_at = fields.DatetimeField(auto_now_add=True)
     credits = fields.IntField(default=25)  # Start users with 5 credits
-    api_key = fields.CharField(max_length=255, null=True)
+    # Service tier, sets the priority of the account's tasks.
+    tier = fields.CharField(max_length=20, default="free")
+    # SHA-256 of the API key, the key itself is only shown once.
+    api_key_hash = fields.CharField(max_length=64, unique=True, null=True)
+    # First characters of the key, to tell keys apart in the UI.
+    api_key_prefix = fields.CharField(max_length=12, null=True)
 
     def __str__(self):
         return self.display_name
 
+    @classmethod
+    async def reserve_credits(cls, account_id: int, amount: int = 1) -> bool:
+        """
+        Take `amount` credits in a single conditional UPDATE.
+
+        Returns False, without touching the row, if the account does not
+        have enough credits.
+        """
+        updated = await cls.filter(
+            id=account_id,
+            credits__gte=amount
+        ).update(credits=F("credits") - amount)
+        return updated == 1
+
+    @classmethod
+    async def refund_credits(cls, account_id: int, amount: int = 1) -> None:
+        await cls.filter(id=account_id).update(credits=F("credits") + amount)
+
 
 class TaskHistory(Model):
     id = fields.IntField(pk=True)
@@ -30,10 +67,180 @@ class TaskHistory(Model):
     )
     task_id = fields.CharField(max_length=255, unique=True)
     task_type = fields.CharField(max_length=50)
-    parameters = fields.JSONField()
+    parameters = fields.JSONField(
+        encoder=fast_json.dumps,
+        decoder=fast_json.loads
+    )
     status = fields.CharField(max_length=50, default="PENDING")
-    result = fields.JSONField(null=True)  # Store task results or error details
+    # Store task results or error details
+    result = fields.JSONField(
+        null=True,
+        encoder=fast_json.dumps,
+        decoder=fast_json.loads
+    )
+    # Credits taken at submission and not yet committed or refunded.
+    reserved_credits = fields.IntField(default=0)
+    # TaskType.params_hash of memoized task types, to find earlier results.
+    params_hash = fields.CharField(max_length=64, null=True)
+    # Client-supplied key making retried submissions return this task.
+    idempotency_key = fields.CharField(max_length=255, null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("user", "idempotency_key"),)
+        # History pages are keyset scans over these two orderings.
+        indexes = (
+            ("user", "created_at"),
+            ("user", "updated_at"),
+            # Lookup of memoized results.
+            ("params_hash", "status"),
+            # Scan of the tasks old enough to archive.
+            ("created_at",),
+        )
 
     def __str__(self):
         return f"{self.task_type} - {self.task_id}"
+
+    @classmethod
+    async def record_state(cls, task_id: str, status: str, result=None):
+        """Set a task's status, and its result once it is ready."""
+        values = {"status": status, "updated_at": timezone.now()}
+        if status in READY_STATES:
+            values["result"] = result
+        await cls.filter(task_id=task_id).update(**values)
+
+    @classmethod
+    async def settle_credits(cls, task_id: str, refund: bool) -> None:
+        """
+        Commit or refund the credits reserved for a task, exactly once.
+
+        The reservation is cleared with a compare-and-set UPDATE, so
+        concurrent settlements of the same task cannot refund twice.
+        """
+        task = await cls.get_or_none(task_id=task_id)
+        if task is None or task.reserved_credits == 0:
+            return
+
+        async with in_transaction():
+            settled = await cls.filter(
+                id=task.id,
+                reserved_credits=task.reserved_credits
+            ).update(reserved_credits=0)
+            if settled and refund:
+                await Account.refund_credits(
+                    task.user_id,
+                    task.reserved_credits
+                )
+
+
+def pack_task_payload(parameters, result) -> bytes:
+    return zlib.compress(fast_json.dumps([parameters, result]).encode())
+
+
+class TaskHistoryArchive(Model):
+    """
+    Finished tasks moved out of TaskHistory once old enough, so the hot
+    table, its indexes and the history pages scanning them stay the size
+    of the retention window rather than of the whole history.
+
+    Parameters and result are stored as one compressed JSON blob; the
+    `parameters` and `result` properties read it like TaskHistory's.
+    """
+    # Id of the TaskHistory row, which keeps history cursors valid.
+    id = fields.IntField(pk=True, generated=False)
+    user = fields.ForeignKeyField(
+        "models.Account",
+        related_name="archived_tasks"
+    )
+    task_id = fields.CharField(max_length=255, unique=True)
+    task_type = fields.CharField(max_length=50)
+    status = fields.CharField(max_length=50)
+    payload = fields.BinaryField()
+    created_at = fields.DatetimeField()
+    updated_at = fields.DatetimeField()
+
+    class Meta:
+        indexes = (
+            ("user", "created_at"),
+            ("user", "updated_at"),
+        )
+
+    def __str__(self):
+        return f"{self.task_type} - {self.task_id} (archived)"
+
+    def unpack_payload(self) -> list:
+        unpacked = getattr(self, "_unpacked", None)
+        if unpacked is None:
+            unpacked = fast_json.loads(zlib.decompress(self.payload))
+            self._unpacked = unpacked
+        return unpacked
+
+    @property
+    def parameters(self):
+        return self.unpack_payload()[0]
+
+    @property
+    def result(self):
+        return self.unpack_payload()[1]
+
+    @classmethod
+    async def archive_batch(
+        cls,
+        created_before: datetime.datetime,
+        batch_size: int
+            ) -> int:
+        """
+        Move up to `batch_size` finished and settled tasks created before
+        `created_before` into the archive. Returns how many were moved.
+        """
+        batch = await TaskHistory.filter(
+            created_at__lt=created_before,
+            status__in=READY_STATES,
+            reserved_credits=0
+        ).order_by("created_at").limit(batch_size)
+        if not batch:
+            return 0
+
+        async with in_transaction():
+            # Rows archived by an overlapping run are skipped.
+            await cls.bulk_create(
+                [
+                    cls(
+                        id=task.id,
+                        user_id=task.user_id,
+                        task_id=task.task_id,
+                        task_type=task.task_type,
+                        status=task.status,
+                        payload=pack_task_payload(
+                            task.parameters,
+                            task.result
+                        ),
+                        created_at=task.created_at,
+                        updated_at=task.updated_at
+                    )
+                    for task in batch
+                ],
+                ignore_conflicts=True
+            )
+            await TaskHistory.filter(
+                id__in=[task.id for task in batch]
+            ).delete()
+        return len(batch)
+
+    @classmethod
+    async def purge_batch(
+        cls,
+        created_before: datetime.datetime,
+        batch_size: int
+            ) -> int:
+        """Delete up to `batch_size` archived tasks created before a date."""
+        task_pks = await cls.filter(
+            created_at__lt=created_before
+        ).order_by("created_at").limit(batch_size).values_list(
+            "id", flat=True
+        )
+        if not task_pks:
+            return 0
+        await cls.filter(id__in=task_pks).delete()
+        return len(task_pks)
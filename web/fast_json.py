@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+
+# pip install orjson
+import orjson
+
+
+# Datetimes as RFC 3339 like isoformat(), dict keys of any scalar type.
+ORJSON_OPTIONS: int = orjson.OPT_NON_STR_KEYS
+
+
+def encode_fallback(value):
+    """JSON-compatible form of what the standard library cannot encode."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value) -> str:
+    """
+    Encode `value` as JSON with orjson.
+
+    Falls back to the standard library for what orjson refuses, such as
+    integers wider than 64 bits.
+    """
+    try:
+        return orjson.dumps(value, option=ORJSON_OPTIONS).decode()
+    except TypeError:
+        return json.dumps(value, default=encode_fallback)
+
+
+def loads(value: str | bytes):
+    return orjson.loads(value)
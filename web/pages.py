@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import functools
+import gzip
+import hashlib
+
+from dataclasses import dataclass
+
+try:
+    # pip install brotli
+    import brotli
+except ImportError:
+    brotli = None
+
+
+TEMPLATES_DIR: str = "web/templates"
+
+# Bodies smaller than this are not worth compressing.
+MIN_COMPRESS_SIZE: int = 512
+
+# Content codings by preference, the smallest output first.
+ENCODINGS: tuple[str, ...] = ("br", "gzip")
+
+# Suffix of the precompressed variant of a static file, by coding.
+ENCODING_SUFFIXES: dict[str, str] = {"br": ".br", "gzip": ".gz"}
+
+@functools.cache
+def get_environment():
+    """The Jinja environment, built when the first page is rendered."""
+    # pip install jinja2
+    import jinja2
+
+    # Templates are compiled on first use and never checked for changes
+    # again: edits need a restart.
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        autoescape=jinja2.select_autoescape(["html"]),
+        auto_reload=False
+    )
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11)
+    # mtime=0 keeps the output, and so ETags, stable across restarts.
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def available_encodings() -> tuple[str, ...]:
+    """The codings of ENCODINGS this process can produce."""
+    return tuple(
+        encoding for encoding in ENCODINGS
+        if encoding != "br" or brotli is not None
+    )
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Content codings allowed by an Accept-Encoding header."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    """An HTML page rendered once, with its compressed variants."""
+    body: bytes
+    etag: str
+    # Content coding -> compressed body.
+    encoded: dict[str, bytes]
+
+    @classmethod
+    def from_html(cls, html: str) -> "RenderedPage":
+        body = html.encode()
+        encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            encoded = {
+                encoding: compress(body, encoding)
+                for encoding in available_encodings()
+            }
+        # Weak: the compressed variants share the tag.
+        etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+        return cls(body=body, etag=etag, encoded=encoded)
+
+    def negotiate(self, accept_encoding: str) -> tuple[bytes, str | None]:
+        """The smallest variant the client accepts, and its coding."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in self.encoded:
+                return self.encoded[encoding], encoding
+        return self.body, None
+
+
+def render(name: str, **context) -> str:
+    return get_environment().get_template(name).render(**context)
+
+
+def render_page(name: str, **context) -> RenderedPage:
+    return RenderedPage.from_html(render(name, **context))
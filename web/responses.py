@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+# pip install orjson
+import orjson
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from web.fast_json import ORJSON_OPTIONS
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered by orjson, datetimes included."""
+
+    def render(self, content) -> bytes:
+        try:
+            return orjson.dumps(content, option=ORJSON_OPTIONS)
+        except TypeError:
+            return super().render(jsonable_encoder(content))
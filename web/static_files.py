@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+from fastapi.staticfiles import StaticFiles
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+from web.pages import ENCODINGS, ENCODING_SUFFIXES
+from web.pages import accepted_encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    Static files with long-lived cache headers, served from their
+    precompressed variants (`<file>.br`, `<file>.gz`, written by
+    scripts/precompress_static.py) when the client accepts them.
+    """
+
+    def __init__(self, *args, max_age: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}"
+
+    async def get_response(self, path: str, scope):
+        accepted = accepted_encodings(
+            Headers(scope=scope).get("accept-encoding", "")
+        )
+        for encoding in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(
+                    path + ENCODING_SUFFIXES[encoding],
+                    scope
+                )
+            except HTTPException:
+                continue
+            if response.status_code == 404:
+                continue
+            # The content type is guessed from the name without suffix.
+            response.headers["Content-Encoding"] = encoding
+            return self.add_cache_headers(response)
+
+        return self.add_cache_headers(
+            await super().get_response(path, scope)
+        )
+
+    def add_cache_headers(self, response):
+        response.headers["Cache-Control"] = self.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response